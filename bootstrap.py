@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import numpy
+import warnings
+from functools import partial
+from itertools import chain
+from utils import parallel_map
+
+def resample(counts, seed, replicate):
+  """
+  Given counts of distinct observations, return the counts in a
+  bootstrap resample: the same number of observations, drawn with
+  replacement. Each `replicate` draws from its own random stream,
+  determined by `seed`, so results do not depend on how replicates are
+  divided among worker processes.
+  """
+  rng = numpy.random.RandomState([seed, replicate])
+  total = counts.sum()
+  return rng.multinomial(total, counts / float(total))
+
+def replicate_statistics(statistic, counts, seed, replicates):
+  return [ statistic(resample(counts, seed, r)) for r in replicates ]
+
+def bootstrap_variance(statistic, counts, replicates, seed=0, jobs=1):
+  """
+  Given a `statistic` function of counts of distinct observations and
+  the observed `counts`, estimate the variance of the statistic from
+  the given number of bootstrap `replicates`, spread over `jobs`
+  worker processes. Replicates for which the statistic is undefined
+  (e.g. no expected disagreement) are left out; if fewer than two
+  are left, a warning is given and the variance is NaN.
+  """
+  if replicates < 2:
+    raise ValueError('bootstrapping needs at least 2 replicates')
+  chunks = [ range(replicates)[i::jobs] for i in range(jobs) ]
+  values = numpy.array(list(chain(*parallel_map(
+    partial(replicate_statistics, statistic, counts, seed), chunks, jobs))))
+  values = values[numpy.isfinite(values)]
+  if len(values) < 2:
+    warnings.warn('fewer than 2 bootstrap replicates have a defined value')
+    return float('nan')
+  return numpy.var(values, ddof=1)
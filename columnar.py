@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import numpy
+import struct
+import sys
+from argparse import ArgumentParser
+from collections import Mapping
+
+# Layout of a columnar segmentation file:
+#
+#   MAGIC, then the header length as a little-endian uint32
+#   header: UTF-8 JSON with the file id, segmentation type, document
+#           and coder dictionaries, and section sizes, padded to 8 bytes
+#   masses: int64 × documents, the total mass of each document
+#   entries: int64 × entries × 4, one (document, coder, start, stop)
+#            row per segmentation, sorted by document and coder
+#   boundaries: int32 × boundaries, the boundary indexes of every
+#               segmentation, sliced by the entries' start and stop
+
+MAGIC = 'SEGC\x00\x01'
+ALIGNMENT = 8
+
+def is_columnar(filename):
+  "Whether `filename` is a columnar segmentation file."
+  with open(filename, 'rb') as f:
+    return f.read(len(MAGIC)) == MAGIC
+
+def padding(length):
+  return -length % ALIGNMENT
+
+def masses_to_boundaries(masses):
+  "Boundary indexes and total mass of a segmentation given as masses."
+  sums = numpy.cumsum(numpy.array(masses, dtype='<i8'))
+  return sums[:-1], int(sums[-1])
+
+def write(o, filename):
+  """
+  Given a segmentation data object (as loaded from the JSON format),
+  write it to `filename` in the columnar format.
+  """
+  documents = sorted(o['items'])
+  coders = sorted(set(c for s in o['items'].values() for c in s))
+  coder_ids = { c:i for i,c in enumerate(coders) }
+  masses, entries, boundaries = [], [], []
+  start = 0
+  for d, doc_id in enumerate(documents):
+    segmentations = o['items'][doc_id]
+    converted = [ masses_to_boundaries(segmentations[c])
+                  for c in sorted(segmentations) ]
+    total_masses = set(m for indexes, m in converted)
+    assert len(total_masses) == 1, 'masses of {} differ'.format(doc_id)
+    masses.append(total_masses.pop())
+    for coder, (indexes, m) in zip(sorted(segmentations), converted):
+      entries.append((d, coder_ids[coder], start, start+len(indexes)))
+      boundaries.append(indexes)
+      start += len(indexes)
+  header = json.dumps({
+      'id': o['id'],
+      'segmentation_type': o['segmentation_type'],
+      'documents': documents,
+      'coders': coders,
+      'entries': len(entries),
+      'boundaries': start }, sort_keys=True)
+  header += ' ' * padding(len(MAGIC) + 4 + len(header))
+  with open(filename, 'wb') as f:
+    f.write(MAGIC)
+    f.write(struct.pack('<I', len(header)))
+    f.write(header)
+    numpy.array(masses, dtype='<i8').tofile(f)
+    numpy.array(entries, dtype='<i8').reshape(-1, 4).tofile(f)
+    numpy.concatenate([numpy.zeros(0, dtype='<i8')] + boundaries).astype(
+      '<i4').tofile(f)
+
+class Segmentations(Mapping):
+  """
+  The ``{coder:segmentation}`` dict of one document in a columnar
+  file. Segment masses are computed from the memory-mapped boundary
+  indexes when a segmentation is looked up.
+  """
+  def __init__(self, boundaries, m, entries):
+    self.boundaries = boundaries
+    self.m = m
+    self.entries = entries
+  def __getitem__(self, coder):
+    start, stop = self.entries[coder]
+    indexes = self.boundaries[start:stop]
+    return numpy.diff(numpy.concatenate(([0], indexes, [self.m]))).tolist()
+  def __iter__(self):
+    return iter(sorted(self.entries))
+  def __len__(self):
+    return len(self.entries)
+
+class Documents(Mapping):
+  "The document items of a columnar file, keyed by document ID."
+  def __init__(self, documents):
+    self.documents = documents
+  def __getitem__(self, doc_id):
+    return self.documents[doc_id]
+  def __iter__(self):
+    return iter(sorted(self.documents))
+  def __len__(self):
+    return len(self.documents)
+
+def load(filename):
+  """
+  Open a columnar segmentation file, returning an object with the same
+  structure as one loaded from the JSON format. The boundary data are
+  memory-mapped rather than read.
+  """
+  data = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+  assert data[:len(MAGIC)].tostring() == MAGIC, 'not a columnar file'
+  [header_length] = struct.unpack(
+    '<I', data[len(MAGIC):len(MAGIC)+4].tostring())
+  position = len(MAGIC) + 4 + header_length
+  header = json.loads(data[len(MAGIC)+4:position].tostring())
+  sections = []
+  for dtype, count in [ ('<i8', len(header['documents'])), 
+                        ('<i8', 4*header['entries']), 
+                        ('<i4', header['boundaries']) ]:
+    length = count*numpy.dtype(dtype).itemsize
+    sections.append(data[position:position+length].view(dtype))
+    position += length
+  masses, entries, boundaries = sections
+  coders = header['coders']
+  documents = {}
+  for d, doc_id in enumerate(header['documents']):
+    documents[doc_id] = Segmentations(boundaries, int(masses[d]), {})
+  for d, c, start, stop in entries.reshape(-1, 4).tolist():
+    documents[header['documents'][d]].entries[coders[c]] = (start, stop)
+  return { 'id': header['id'],
+           'segmentation_type': header['segmentation_type'],
+           'items': Documents(documents) }
+
+def to_json(o):
+  "Convert loaded segmentation data to plain dicts for JSON output."
+  return { 'id': o['id'],
+           'segmentation_type': o['segmentation_type'],
+           'items': { doc_id:dict(segmentations) 
+                      for doc_id, segmentations in o['items'].items() } }
+
+def parse_args():
+  p = ArgumentParser(description=main.__doc__)
+  p.add_argument(
+    'filename', help='name of the JSON or columnar segmentation file')
+  p.add_argument(
+    '-o', '--output', 
+    help='columnar file to write (when converting from JSON)')
+  return p.parse_args()
+
+def main():
+  "Convert a segmentation file between the JSON and columnar formats."
+  args = parse_args()
+  if is_columnar(args.filename):
+    print json.dumps(to_json(load(args.filename)), sort_keys=True)
+  else:
+    if args.output is None:
+      sys.exit('an output filename is needed to write a columnar file')
+    with open(args.filename) as data:
+      write(json.load(data), args.output)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import mean_pi
+import near_agreement_alpha
+import near_agreement_multipi
+import strict_agreement
+from argparse import ArgumentParser
+from collections import namedtuple
+from functools import partial
+from utils import *
+from windowdiff import *
+
+Prepared = namedtuple('Prepared', 'c index_lists m strict windows')
+
+def prepare(segmentations, k=None):
+  """
+  Given coders' segmentations (represented as segment masses), derive
+  the structures shared by all the coefficients: boundary index lists,
+  total mass, and accumulators of the boundary and window judgments.
+  """
+  index_lists, m = masses_to_indexes(segmentations)
+  if k is None: k = window_size(segmentations)
+  c = len(segmentations)
+  return Prepared(c, index_lists, m,
+                  strict_agreement.MultiPiAccumulator.from_judgments(
+                    c, boundary_counts(index_lists, m)),
+                  WindowAccumulator.from_indexes(index_lists, m, k))
+
+def accumulated_coefficients(strict, windows):
+  """
+  Given a `MultiPiAccumulator` and a `WindowAccumulator`, return a
+  dict of ``(coefficient, variance)`` pairs.
+  """
+  return {
+    'strict': strict.coefficient(),
+    'near-alpha': near_agreement_alpha.accumulated_alpha(windows),
+    'near-pi': near_agreement_multipi.accumulated_multi_pi(windows) }
+
+def coefficients(prepared, gold_masses=None):
+  """
+  Given prepared segmentations and optionally a gold segmentation,
+  return a dict of ``(coefficient, variance)`` pairs, plus the list of
+  the coders' π values against gold if a gold segmentation was given.
+  """
+  d = accumulated_coefficients(prepared.strict, prepared.windows)
+  if gold_masses is None:
+    return d, []
+  [gold_indexes], gold_m = masses_to_indexes([gold_masses])
+  assert gold_m == prepared.m
+  [pis] = mean_pi.pi_matrix(
+    prepared.index_lists, [gold_indexes], prepared.m).tolist()
+  d['mean-pi'] = (mean_pi.mean(pis), None)
+  return d, pis
+
+COLUMNS = [ ('strict', 'strict multi-π'),
+            ('near-alpha', 'near α'),
+            ('near-pi', 'near multi-π'),
+            ('mean-pi', 'mean π') ]
+
+def evaluate_document(k, overall_k, task):
+  """
+  Calculate `coefficients` for a (segmentations, gold masses) pair,
+  and return them along with the accumulators to be merged for the
+  overall coefficients, with windows of size `overall_k`.
+  """
+  segmentations, gold_masses = task
+  prepared = prepare(segmentations, k)
+  windows = prepared.windows
+  if windows.k != overall_k:
+    windows = WindowAccumulator.from_indexes(
+      prepared.index_lists, prepared.m, overall_k)
+  d, pis = coefficients(prepared, gold_masses)
+  return d, pis, prepared.strict, windows
+
+def show_report(per_document, overall):
+  columns = [ (key, title) for key, title in COLUMNS if key in overall ]
+  def row(label, cells):
+    print (u'{:<12}'.format(label) + u''.join(
+        u'{:>16}'.format(cell.decode('utf-8')) for cell in cells)
+           ).encode('utf-8')
+  def coefficients_row(label, d):
+    row(label, [ format_coefficient(*d[key]) for key, title in columns ])
+  print '''
+Strict and near segmentation agreement, and mean strict agreement with
+a "gold" segmentation if one was given.
+'''
+  row('', [ title for key, title in columns ])
+  print
+  for doc_id, d in sorted(per_document.items()):
+    coefficients_row(doc_id.split(':')[-1], d)
+  print
+  coefficients_row('Overall', overall)
+  print
+
+def parse_args():
+  p = ArgumentParser(description=main.__doc__)
+  p.add_argument(
+    'filename', help='name of the JSON segmentation file')
+  p.add_argument(
+    '-c', '--coder', help='only include specified coders',
+    action='append', dest='coders')
+  p.add_argument(
+    '--reference', help='name of the reference annotator used to calculate k')
+  p.add_argument(
+    '-g', '--gold', metavar='filename',
+    help='name of a gold segmentation file to calculate mean π against')
+  p.add_argument(
+    '-j', '--jobs', metavar='J', type=int, default=1, 
+    help='number of worker processes to use')
+  return p.parse_args()
+
+def main():
+  "Calculates all of the agreement coefficients in a single pass."
+  args = parse_args()
+  o = load_segmentation_data(args.filename)
+  items = filter_coders(o['items'], args.coders) if args.coders else o['items']
+  gold = load_segmentation_data(args.gold)['items'] if args.gold else {}
+  doc_ids, segmentations = document_segmentations(items)
+  if args.reference is None:
+    k, overall_k = None, combined_window_size(segmentations)
+  else:
+    k = overall_k = window_size([ s[args.reference] for s in items.values() ])
+  tasks = [ (s, gold[d]['gold'] if gold else None) 
+            for d,s in zip(doc_ids, segmentations) ]
+  results = balanced_map(partial(evaluate_document, k, overall_k), tasks,
+                         [ task_size(s) for s,gold_masses in tasks ], 
+                         args.jobs)
+  per_document = { d:coefficients for d,(coefficients,pis,strict,windows) 
+                   in zip(doc_ids, results) }
+  overall = accumulated_coefficients(
+    merge_accumulators([ strict for d,pis,strict,windows in results ]),
+    merge_accumulators([ windows for d,pis,strict,windows in results ]))
+  if gold:
+    overall['mean-pi'] = (mean_pi.mean(list(chain(
+            *[ pis for d,pis,strict,windows in results ]))), None)
+  show_report(per_document, overall)
+
+if __name__ == "__main__":
+  main()
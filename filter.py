@@ -10,17 +10,23 @@ def parse_args():
     'filename', help='name of the JSON segmentation file')
   p.add_argument(
     'coders', help='only include specified coders', action='append')
+  p.add_argument(
+    '--ndjson', action='store_true',
+    help='write one document per line as soon as it is ready')
   return p.parse_args()
 
 def main():
   "Filter a segmentation file to only include the specified coders."
   args = parse_args()
-  o = load_segmentation_data(args.filename)
-  filtered = {
-    'segmentation_type': o['segmentation_type'],
-    'id': '&'.join([ c.lower() for c in args.coders ]),
-    'items': filter_coders(o['items'], args.coders) }
-  print json.dumps(filtered, sort_keys=True)
+  reader = read_segmentation_data(args.filename)
+  filtered = ( (doc_id, { k:v for k,v in s.items() if k in args.coders })
+               for doc_id, s in reader )
+  # the segmentation type usually follows the items, so it is only
+  # read once they have been (unless it is needed first, for NDJSON)
+  write_segmentation_data(lambda: {
+    'segmentation_type': reader.field('segmentation_type', 'linear'),
+    'id': '&'.join([ c.lower() for c in args.coders ]) }, 
+    filtered, args.ndjson)
   
 if __name__ == "__main__":
   main()
@@ -1,144 +1,287 @@
 #! /usr/bin/env python
 
+import os
 import re
+import shlex
 import sys
 import json
 import redis
-from Queue import Queue, Empty
-from functools import partial, wraps
+import redisutils
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from functools import partial
 from itertools import chain, ifilterfalse, groupby
 from lxml import etree
-from subprocess import Popen, PIPE
-from threading import Thread
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+from redisutils import BulkWriter, connect
+from sentencecache import SentenceCache
+from subprocess import Popen, PIPE, CalledProcessError
 from types import UnicodeType
 
-def enqueue_output(out, queue):
-  [ queue.put(line) for line in iter(out.readline, b'') ]
-  out.close()
-
-def launch_splitta():
+# The sentence splitter reads paragraphs on stdin and writes one
+# sentence per line. Another command (e.g. a stand-in for testing) can
+# be given in the SPLITTER environment variable.
+SPLITTER = shlex.split(os.environ.get('SPLITTER', 'splitta'))
+# part of the cache key, so that a different splitter is not given
+# another's results
+SPLITTER_VERSION = os.environ.get('SPLITTER_VERSION', ' '.join(SPLITTER))
+# the directory of DocSouth XML files, one per interview
+CORPUS_ROOT = os.environ.get(
+  'CORPUS_ROOT', '/Users/ryanshaw/Data/sohp/docsouth')
+# interviews are read, split and aligned in this many worker processes
+INTERVIEW_JOBS = int(os.environ.get('INTERVIEW_JOBS', cpu_count()))
+# splitter runs at once in each worker, by default sharing the CPUs
+# among the workers
+SPLITTER_JOBS = int(os.environ.get(
+    'SPLITTER_JOBS', max(1, cpu_count() // INTERVIEW_JOBS)))
+# paragraphs in a batch are separated by a word the splitter will keep
+# (lengthened if a paragraph in the batch contains it)
+DELIMITER = u'SPLITTERDELIMITER'
+SPLIT_BATCH_SIZE = 200
+
+def split_batch(texts):
+  """
+  Split a batch of paragraphs into sentences with one run of the
+  splitter, returning a list of sentence lists.
+  """
+  delimiter = DELIMITER
+  while any(delimiter in t for t in texts):
+    delimiter += u'X'
   ON_POSIX = 'posix' in sys.builtin_module_names
-  p = Popen(['splitta'], stdin=PIPE, stdout=PIPE, bufsize=1, close_fds=ON_POSIX)
-  q = Queue()
-  t = Thread(target=enqueue_output, args=(p.stdout, q))
-  t.daemon = True # thread dies with the program
-  t.start()
-  return p,q
-
-def memoize(f):
-  @wraps(f)
-  def wrapper(*args):
-    assert len(args) == 1
-    arg = args[0]
-    if arg not in cache:
-      cache[arg] = f(arg)
-    return cache[arg]
-  return wrapper
-
-cache = {}
-
-@memoize
+  p = Popen(SPLITTER, stdin=PIPE, stdout=PIPE, close_fds=ON_POSIX)
+  out, _ = p.communicate(
+    u'\n\n{}\n\n'.format(delimiter).join(texts).encode('utf-8'))
+  if p.returncode != 0:
+    raise CalledProcessError(p.returncode, SPLITTER)
+  chunks = out.decode('utf-8').split(delimiter)
+  assert len(chunks) == len(texts), 'splitter lost a delimiter'
+  return [ [ line.strip() for line in chunk.split(u'\n') if line.strip() ]
+           for chunk in chunks ]
+
+# guards the lazily started splitter pool and sentence cache
+started = threading.Lock()
+splitter_pool = None
+
+def get_splitter_pool():
+  "The pool of threads running the splitter, started when first needed."
+  global splitter_pool
+  with started:
+    if splitter_pool is None:
+      splitter_pool = ThreadPool(SPLITTER_JOBS)
+  return splitter_pool
+
+sentence_cache = None
+
+def get_sentence_cache():
+  """
+  The cache of split paragraphs, opened when first needed. Its file
+  and optional size bound (in entries) can be set with the SPLIT_CACHE
+  and SPLIT_CACHE_SIZE environment variables.
+  """
+  global sentence_cache
+  with started:
+    if sentence_cache is None:
+      size = os.environ.get('SPLIT_CACHE_SIZE')
+      sentence_cache = SentenceCache(
+        os.environ.get('SPLIT_CACHE', 'cache.sqlite'), SPLITTER_VERSION,
+        int(size) if size else None)
+  return sentence_cache
+
 def split(text):
-  p,q = launch_splitta()
-  p.stdin.write(text.encode('utf-8'))
-  p.stdin.close()
-  lines = []
-  while True:
-    try:  
-      lines.append(q.get(timeout=.01).decode('utf-8')[:-1])
-    except Empty:
-      if len(lines) > 0:
-        return lines
+  [lines] = split_paragraphs([text])
+  return lines
+
+def split_paragraphs(texts):
+  """
+  Split paragraphs into sentences, returning a list of sentence lists.
+  Paragraphs that are not in the cache are sent to the splitter in
+  batches, which the splitter pool runs concurrently, and each batch
+  is added to the cache as soon as it is split.
+  """
+  cache = get_sentence_cache()
+  split_texts = cache.get_many(texts)
+  missing = sorted(set(texts) - set(split_texts))
+  batches = [ missing[i:i+SPLIT_BATCH_SIZE] 
+              for i in range(0, len(missing), SPLIT_BATCH_SIZE) ]
+  for batch, results in zip(
+      batches, get_splitter_pool().imap(split_batch, batches)):
+    cache.put_many(zip(batch, results))
+    split_texts.update(zip(batch, results))
+  return [ split_texts[t] for t in texts ]
 
 def clean(text):
   assert type(text) is UnicodeType, 'Bad text: {}'.format(text)
   return re.sub('\s+', ' ', text).strip()
 
-def sentences(e):
-  return [ split(clean(etree.tostring(p, method='text', encoding='unicode'))) 
+def paragraphs(e):
+  return [ clean(etree.tostring(p, method='text', encoding='unicode')) 
            for p in e.xpath('p') ]
 
-def get_speakers(interview):
-  tree = etree.parse(
-    '/Users/ryanshaw/Data/sohp/docsouth/{}.xml'.format(interview))
-  return [ (e[0].text.strip(' :'), sentences(e)) for e in tree.xpath('//sp') ]
+def read_speeches(filename):
+  """
+  Generate the ``(speaker, paragraphs)`` of each <sp> element in an XML
+  file, streaming the file so that only the current element is held
+  in memory: each element is freed, along with the siblings before it,
+  once its text has been read.
+  """
+  for event, e in etree.iterparse(filename, tag='sp'):
+    speech = (e[0].text.strip(' :'), paragraphs(e))
+    e.clear()
+    while e.getprevious() is not None:
+      del e.getparent()[0]
+    yield speech
 
-def read_cache():
-  try:
-    with open('cache.json') as f:
-      cache = json.load(f) 
-  except IOError:
-    cache = {}
-  return cache
-
-def write_cache():
-  with open('cache.json', 'w') as f:
-    json.dump(cache, f) 
-
-class PeekableIterator:
-  def __init__(self, iterable):
-    self.iter = iter(iterable)
-    self.queue = []
-  def __iter__(self):
-    return self
-  def next(self):
-    if self.queue:
-      return self.queue.pop()
-    else:
-      return self.iter.next()
-  def push(self, x):
-    self.queue.append(x)
-
-def sametext(x_s, r_s):
-  if type(x_s) is UnicodeType:
-    x_text = x_s
-  else:
-    x_text = x_s[u'text']
-  if type(r_s) is UnicodeType:
-    r_text = r_s
-  else:
-    r_text = r_s[u'text']
-  return x_text.replace(u' ',u'') == r_text.replace(u' ',u'')
+def get_speakers(interview):
+  speeches = list(read_speeches(
+      os.path.join(CORPUS_ROOT, '{}.xml'.format(interview))))
+  split_texts = iter(split_paragraphs(
+      list(chain(*[ texts for speaker, texts in speeches ]))))
+  return [ (speaker, [ next(split_texts) for t in texts ]) 
+           for speaker, texts in speeches ]
+
+def normalized(s):
+  "A sentence's text without spaces, for comparing texts."
+  text = s if type(s) is UnicodeType else s[u'text']
+  return text.replace(u' ',u'')
 
 def align(x_sentences, r_sentences):
-  x_iter = PeekableIterator(x_sentences)
-  r_iter = PeekableIterator(r_sentences)
-  while True:
-    x_s = x_iter.next()
-    r_s = r_iter.next()
-    if sametext(x_s,r_s):
-      yield x_s,r_s
+  """
+  Align the sentences split from the XML (x) with the sentences in
+  Redis (r), generating an ``(x_s, r_s)`` pair for each r sentence.
+  Sentences whose normalized text appears once in each list anchor
+  the alignment (see `anchors`); the r sentences left between anchors
+  are paired by `align_gap`, so any number of dropped, split and
+  merged sentences can be handled. An anchor that leaves sentences
+  before it unaligned is ignored, up to `MAX_SKIPPED_ANCHORS` in a
+  row; after that the sentence that cannot be aligned is reported.
+  """
+  x_texts = map(normalized, x_sentences)
+  r_texts = map(normalized, r_sentences)
+  end = (len(x_texts), len(r_texts))
+  i = j = skipped = 0
+  for a, b in anchors(x_texts, r_texts) + [ end ]:
+    gap = list(align_gap(x_texts[i:a], r_texts[j:b]))
+    unaligned = [ r_index for x_index, r_index in gap if x_index is None ]
+    if unaligned and (a, b) != end and skipped < MAX_SKIPPED_ANCHORS:
+      # a short sentence can be a false anchor (a piece of a split
+      # sentence), so align across it instead
+      skipped += 1
+      continue
+    if unaligned:
+      raise Exception('\n' + '\n\n'.join(map(dict2str, 
+          list(x_sentences[i:a]) + [ r_sentences[j+unaligned[0]] ])))
+    for x_index, r_index in gap:
+      yield x_sentences[i+x_index], r_sentences[j+r_index]
+    if (a, b) != end:
+      yield x_sentences[a], r_sentences[b]
+    i, j, skipped = a+1, b+1, 0
+
+def anchors(x_texts, r_texts):
+  """
+  Return the ``(x_index, r_index)`` pairs of texts that appear exactly
+  once in each list, keeping the longest sequence of pairs that are
+  in the same order in both (as in patience diff).
+  """
+  x_counts, r_counts = Counter(x_texts), Counter(r_texts)
+  r_index = { t:j for j,t in enumerate(r_texts) if r_counts[t] == 1 }
+  pairs = [ (i, r_index[t]) for i,t in enumerate(x_texts) 
+            if x_counts[t] == 1 and t in r_index ]
+  # longest increasing subsequence of r indexes, by patience sorting
+  tops, top_values, previous = [], [], []
+  for k, (i, j) in enumerate(pairs):
+    pile = bisect_left(top_values, j)
+    previous.append(tops[pile-1] if pile > 0 else None)
+    if pile == len(tops):
+      tops.append(k)
+      top_values.append(j)
+    else:
+      tops[pile] = k
+      top_values[pile] = j
+  sequence = []
+  k = tops[-1] if tops else None
+  while k is not None:
+    sequence.append(pairs[k])
+    k = previous[k]
+  return sequence[::-1]
+
+# the most sentences on either side of a split, merge or stray bracket
+MAX_GROUP = 6
+# the most anchors in a row `align` will skip, so that a sentence that
+# cannot be aligned does not make the gaps to be aligned grow and grow
+MAX_SKIPPED_ANCHORS = 3
+
+def offsets(texts):
+  "The offsets of `texts` in their concatenation, and its length."
+  starts = [0]
+  for text in texts:
+    starts.append(starts[-1] + len(text))
+  return starts
+
+def groups(x_texts, r_texts, i, j, x_starts, r_starts):
+  """
+  Generate the ``(p, q)`` sizes of the groups of x and r sentences
+  starting at `i` and `j` whose concatenated texts are the same,
+  smallest first.
+  """
+  sizes = [ (p, q) for p in range(1, MAX_GROUP+1) 
+            for q in range(1, MAX_GROUP+1) ]
+  for p, q in sorted(sizes, key=lambda (p, q): (p+q, p)):
+    if i+p > len(x_texts) or j+q > len(r_texts):
+      continue
+    if (x_starts[i+p] - x_starts[i] == r_starts[j+q] - r_starts[j] and
+        u''.join(x_texts[i:i+p]) == u''.join(r_texts[j:j+q])):
+      yield p, q
+
+def align_group(x_texts, r_texts):
+  """
+  Given x and r texts with the same concatenation, generate an
+  ``(x_index, r_index)`` pair for each r text: the x text starting at
+  the same character, or else the one it overlaps most.
+  """
+  x_starts, r_starts = offsets(x_texts), offsets(r_texts)
+  for r_index, (start, end) in enumerate(zip(r_starts, r_starts[1:])):
+    if start in x_starts[:-1]:
+      yield x_starts.index(start), r_index
     else:
-      x_next_s = x_iter.next()
-      r_next_s = r_iter.next()
-      if sametext(x_next_s,r_s):
-        # 1 dropped sentence
-        yield x_next_s,r_s
-        r_iter.push(r_next_s)
-      elif sametext(x_s[u'text']+x_next_s[u'text'], r_s):
-        # combined sentence
-        yield x_s,r_s
-        r_iter.push(r_next_s)
-      elif sametext(x_s, r_s[u'text']+r_next_s[u'text']):
-        # split sentence
-        yield x_s,r_s
-        yield x_s,r_next_s
-        x_iter.push(x_next_s)
-      elif sametext(x_s[u'text']+x_next_s[u'text'],
-                    r_s[u'text']+r_next_s[u'text']):
-        # stray bracket
-        yield x_s,r_s
-        yield x_next_s,r_next_s
-      else:
-        x_next_next_s = x_iter.next()
-        if sametext(x_next_next_s,r_s[u'text']):
-          # 2 dropped sentences
-          yield x_next_next_s,r_s
-          r_iter.push(r_next_s)
-        else:
-          raise Exception('\n' + '\n\n'.join(
-              [ dict2str(s) for s in (x_s, x_next_s, x_next_next_s,
-                                      r_s, r_next_s) ]))
+      overlaps = [ min(end, x_end) - max(start, x_start) 
+                   for x_start, x_end in zip(x_starts, x_starts[1:]) ]
+      yield overlaps.index(max(overlaps)), r_index
+
+def align_gap(x_texts, r_texts):
+  """
+  Given the normalized texts of the x and r sentences between two
+  anchors, generate an ``(x_index, r_index)`` pair for each r sentence
+  (with an x_index of None if it cannot be aligned). The alignment
+  drops as few x sentences as possible, and otherwise pairs groups of
+  up to `MAX_GROUP` sentences with the same concatenated text (one to
+  one for unchanged sentences).
+  """
+  nx, nr = len(x_texts), len(r_texts)
+  x_starts, r_starts = offsets(x_texts), offsets(r_texts)
+  unaligned = float('inf')
+  # cost[i][j] is the fewest x sentences dropped aligning x[i:] to r[j:]
+  cost = [ [unaligned] * (nr+1) for i in range(nx+1) ]
+  step = [ [None] * (nr+1) for i in range(nx+1) ]
+  for i in range(nx, -1, -1):
+    cost[i][nr] = nx - i
+    for j in range(nr-1, -1, -1):
+      for p, q in groups(x_texts, r_texts, i, j, x_starts, r_starts):
+        if cost[i+p][j+q] < cost[i][j]:
+          cost[i][j], step[i][j] = cost[i+p][j+q], (p, q)
+      if i < nx and 1 + cost[i+1][j] < cost[i][j]:
+        cost[i][j], step[i][j] = 1 + cost[i+1][j], (1, 0)
+  i = j = 0
+  while j < nr:
+    if step[i][j] is None:
+      for r_index in range(j, nr):
+        yield None, r_index
+      return
+    p, q = step[i][j]
+    for x_index, r_index in align_group(x_texts[i:i+p], r_texts[j:j+q]):
+      yield i+x_index, j+r_index
+    i, j = i+p, j+q
 
 def flatten_speechblock(index, block):
   speechblock = u'speechblocks:{}/{}'.format(
@@ -188,7 +331,12 @@ def fix_sentence(x_s, r_s):
   x_items = [ (k,x_s[k]) for k in (u'index',u'speechblock',u'speaker') ]
   return dict(r_items + x_items)
 
-def fix_interview(r, interview):
+def fix_interview(interview):
+  """
+  Read, split and align an interview's sentences, with a Redis client
+  of its own so that it can run in a worker process.
+  """
+  r = connect(decode_responses=True)
   x_sentences = get_sentences(interview)
   [r_keys,r_sentences] = zip(*[ (k, r.hgetall(k)) for k in r.lrange(
         'interviews:{}:sentences'.format(interview), 0, -1) ])
@@ -209,26 +357,60 @@ def ifdigit(s):
 def sortkey(k):
   return [ (int(s) if s.isdigit() else s) for s in re.split(r':|/', k) ]
 
-def set_list(r, key, values):
-  r.delete(key)
-  r.rpush(key, *sorted(set(values), key=sortkey))
-
-def index_by(r, items, field, index, val=lambda x: x[0]):
-  key = lambda x: x[1][field]
-  [ set_list(r, '{}:{}'.format(k,index),  [ val(x) for x in g ])
-    for k,g in groupby(sorted(items, key=key), key=key) ]
-
-def update(r, items):
-  [ r.hmset(k,v) for k,v in items ]
-  index_by(r, items, 'speaker', 'sentences')
-  index_by(r, items, 'speechblock', 'sentences')
-  index_by(r, items, 'speaker', 'speechblocks', lambda x: x[1]['speechblock'])
-  index_by(r, items, 'interview', 'speechblocks', lambda x: x[1]['speechblock'])
-  index_by(r, items, 'interview', 'speakers', lambda x: x[1]['speaker'])
+# secondary indexes: the field grouped by, the name of the index, and
+# the value listed for each (key, sentence) item
+INDEXES = [
+  ('speaker', 'sentences', lambda k,s: k),
+  ('speechblock', 'sentences', lambda k,s: k),
+  ('speaker', 'speechblocks', lambda k,s: s['speechblock']),
+  ('interview', 'speechblocks', lambda k,s: s['speechblock']),
+  ('interview', 'speakers', lambda k,s: s['speaker']) ]
+
+def index_lists(items):
+  """
+  Build all the secondary `INDEXES` of (key, sentence) items in one
+  pass, returning a dict of index keys and sorted lists of values.
+  """
+  lists = defaultdict(set)
+  for k,s in items:
+    for field, index, val in INDEXES:
+      lists['{}:{}'.format(s[field], index)].add(val(k,s))
+  return { key:sorted(values, key=sortkey) for key,values in lists.items() }
+
+# commands per transaction when writing the fixed sentences
+WRITE_BATCH_SIZE = int(
+  os.environ.get('WRITE_BATCH_SIZE', redisutils.BATCH_SIZE))
+
+def update(r, items, batch_size=WRITE_BATCH_SIZE):
+  """
+  Write the sentences and their secondary indexes, in transactions of
+  about `batch_size` commands, and report the throughput.
+  """
+  writer = BulkWriter(r, batch_size)
+  for k,v in items:
+    writer.hmset(k,v)
+  for key, values in sorted(index_lists(items).items()):
+    writer.replace_list(key, values)
+  writer.flush()
+  print 'Wrote {} sentences: {}'.format(len(items), writer.report())
+
+def fix_interviews(interviews, jobs=INTERVIEW_JOBS):
+  """
+  Fix `interviews` in a pool of `jobs` worker processes, returning the
+  results in order. Each worker handles a single interview, so the
+  memory used for one is returned when it is done.
+  """
+  if jobs == 1:
+    return map(fix_interview, interviews)
+  pool = Pool(min(jobs, len(interviews)), maxtasksperchild=1)
+  try:
+    return pool.map(fix_interview, interviews, chunksize=1)
+  finally:
+    pool.terminate()
 
 def main(interviews):
   r = redis.StrictRedis(decode_responses=True)
-  [keys,original,fixed] = zip(*[ fix_interview(r,i) for i in interviews ])
+  [keys,original,fixed] = zip(*fix_interviews(interviews))
   o = dict(zip(chain(*keys),chain(*original)))
   f = dict(zip(chain(*keys),chain(*fixed)))
   save(o, 'original.json')
@@ -257,10 +439,6 @@ if __name__ == "__main__":
     'U-0186',
     'U-0193',
     ]
-  cache = read_cache()
-  try:
-    main(interviews)
-  finally:
-    write_cache()
+  main(interviews)
 
 
@@ -1,7 +1,9 @@
 #! /usr/bin/env python
 
+import numpy
 from argparse import ArgumentParser
-from functools import partial
+from bisect import bisect_left
+from collections import defaultdict
 from itertools import *
 from operator import sub
 from utils import *
@@ -12,41 +14,25 @@ def length(interview):
   with open('{}.txt'.format(interview_id)) as t:
     return len(t.readlines())
 
-def every_nth(n, *iterables):
-  "Given a sequence of iterables, return every nth item"
-  return islice(chain(*iterables), n-1, None, n)
-
-def unique_everseen(iterable, key=None):
-  "List unique elements, preserving order. Remember all elements ever seen."
-  seen = set()
-  seen_add = seen.add
-  if key is None:
-    for element in ifilterfalse(seen.__contains__, iterable):
-      seen_add(element)
-      yield element
-  else:
-    for element in iterable:
-      k = key(element)
-      if k not in seen:
-        seen_add(k)
-        yield element
-
 def near_intersection(window, s1, s2):
-  # take distances of pairs of values from the two sets
-  pairs = ((abs(x-y),x,y) for x,y in product(s1,s2))
-  # filter out ones with distance >= window
-  filtered = ifilter(lambda x: x[0] < window, pairs)
-  # order by distance and first value
-  key = lambda x:x[:2]
-  ordered = sorted(filtered, key=key)
-  # filter out repeated second values
-  unique = unique_everseen(ordered, key=lambda x:x[2])
-  # group by distance and first value
-  grouped = groupby(unique, key=key)
-  # merge equidistant indexes
-  merged = [ k + tuple(every_nth(3,*g)) for k,g in grouped ]
-  # take means to get consensus indexes
-  return set((sum(s[1:])/len(s[1:])) for s in merged)
+  """
+  Match each index in `s2` to the closest index in `s1` that is less
+  than `window` away (the earlier one if two are equally close), and
+  return the consensus indexes: the mean of each matched `s1` index
+  and the `s2` indexes matched to it at the same distance.
+  """
+  l1 = sorted(s1)
+  matches = defaultdict(list)
+  for y in s2:
+    # only the neighbors of y's insertion point can be the closest
+    i = bisect_left(l1, y)
+    candidates = [ (abs(x-y),x) for x in l1[max(i-1,0):i+1] ]
+    if candidates:
+      distance, x = min(candidates)
+      if distance < window:
+        matches[(distance,x)].append(y)
+  return set((x + sum(ys)) / (len(ys) + 1) 
+             for (distance,x),ys in matches.items())
 
 def merge_small_segments(masses, window):
   to_merge = 0
@@ -64,16 +50,38 @@ def merge_small_segments(masses, window):
   merged[-1] += to_merge
   return merged
 
-def derive_gold(segmentations, near=False):
+def boundary_votes(index_lists, m, weights=None):
+  """
+  Given boundary index lists (one per coder), a total mass `m`, and
+  optionally a weight for each coder (1 by default), return an array
+  of the total weight of the coders who placed a boundary at each
+  potential boundary index from 1 to ``m-1``.
+  """
+  if weights is None:
+    return boundary_counts(index_lists, m)
+  # the leading 0 keeps bincount happy when no boundaries were placed
+  indexes = numpy.array([0] + list(chain(*index_lists)), dtype=int)
+  votes = numpy.repeat([0] + list(weights), [1] + map(len, index_lists))
+  return numpy.bincount(indexes, weights=votes, minlength=m)[1:m]
+
+def derive_gold(segmentations, near=False, threshold=2, weights=None):
+  """
+  Derive a gold segmentation from coders' segmentations by majority
+  vote. Strict gold has a boundary wherever the coders' votes (see
+  `boundary_votes`) reach `threshold`; by default, wherever at least
+  two coders agree. Near gold has a boundary for each pair of coders'
+  boundaries less than a window apart.
+  """
+  index_lists, m = masses_to_indexes(segmentations)
   if near:
     window = window_size(segmentations)
-    intersect = partial(near_intersection, window)
+    index_sets = [ set(l) for l in index_lists ]
+    intersections = [ near_intersection(window, *pair) 
+                      for pair in combinations(index_sets, 2) ]
+    gold_indexes = sorted(set.union(*intersections))
   else:
-    intersect = set.intersection
-  index_lists, m = masses_to_indexes(segmentations)
-  index_sets = [ set(l) for l in index_lists ]
-  intersections = [ intersect(*pair) for pair in combinations(index_sets, 2) ]
-  gold_indexes = sorted(set.union(*intersections))
+    votes = boundary_votes(index_lists, m, weights)
+    gold_indexes = (numpy.flatnonzero(votes >= threshold) + 1).tolist()
   [gold_masses] = indexes_to_masses([gold_indexes], m)
   if near:
     return { 'gold': merge_small_segments(gold_masses, window) }
@@ -88,13 +96,28 @@ def main():
   p.add_argument(
     '-n', '--near', action='store_true',
     help='count near agreement when majority voting')
+  p.add_argument(
+    '-t', '--threshold', type=float, default=2,
+    help='votes needed for a strict gold boundary (default: 2)')
+  p.add_argument(
+    '-w', '--weight', metavar='coder:weight', action='append', default=[],
+    help="weight of a coder's votes (default: 1)")
+  p.add_argument(
+    '--ndjson', action='store_true',
+    help='write one document per line as soon as it is ready')
   args = p.parse_args()
-  o = load_segmentation_data(args.filename)
-  gold = { 'id':o['id'], 'segmentation_type':'linear' }
-  gold['items'] = { 
-    interview: derive_gold(segmentations.values(), args.near) 
-    for interview, segmentations in o['items'].items() }
-  print json.dumps(gold, sort_keys=True)
+  if args.near and (args.weight or args.threshold != 2):
+    p.error('--threshold and --weight only apply to strict gold')
+  weights = { c:float(w) for c,w in [ s.rsplit(':', 1) for s in args.weight ] }
+  reader = read_segmentation_data(args.filename)
+  # near gold depends on the order of the coders, so keep the dict's
+  gold = ( (interview, derive_gold(
+        segmentations.values(), args.near, args.threshold, 
+        [ weights.get(c, 1) for c in segmentations.keys() ]))
+           for interview, segmentations in reader )
+  write_segmentation_data(
+    { 'id':reader.field('id'), 'segmentation_type':'linear' }, 
+    gold, args.ndjson)
       
 if __name__ == "__main__":
   main()
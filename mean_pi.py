@@ -1,6 +1,8 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import numpy
+import os.path
 from argparse import ArgumentParser
 from utils import *
 
@@ -29,15 +31,51 @@ def pi(c, g, m):
   e = expected_agreement(m-1, len(c)+len(g))
   return (o-e) / (1-e)
 
+def pi_matrix(index_lists, gold_index_lists, m):
+  """
+  Given coders' boundary index lists, gold boundary index lists, and
+  total mass `m`, return a golds × coders array of the agreement of
+  each coder with each gold according to π. The agreed positive
+  judgments of every pair are counted at once, as a product of the
+  golds' and coders' boundary indicator matrices.
+
+  As with `pi`, raises ZeroDivisionError if the expected agreement of
+  any pair is 1 (neither, or both, place a boundary everywhere).
+  """
+  i = m-1
+  coders = boundary_matrix(index_lists, m)
+  golds = boundary_matrix(gold_index_lists, m)
+  agreed_pos = golds.dot(coders.T)
+  # positive judgments by each gold and coder pair
+  n = golds.sum(axis=1)[:,numpy.newaxis] + coders.sum(axis=1)
+  agreed_neg = i - (n - agreed_pos)
+  o = (agreed_pos + agreed_neg) / float(i)
+  e = (n**2 + (2*i-n)**2) / float(4*(i**2))
+  if (e == 1).any():
+    raise ZeroDivisionError('expected agreement is 1')
+  return (o-e) / (1-e)
+
 def pis(segmentations, gold_masses):
   """
   Given coders' segmentations and a gold segmentation (represented as
-  segment masses), calculate mean agreement with gold.
+  segment masses), calculate each coder's agreement with gold.
+  """
+  [gold_pis] = golds_pis(segmentations, [gold_masses])
+  return gold_pis
+
+def golds_pis(segmentations, gold_masses_list):
+  """
+  Like `pis`, but given a list of gold segmentations, returning a list
+  of the coders' agreements with each.
   """
   index_lists, m = masses_to_indexes(segmentations)
-  [gold_indexes], gold_m = masses_to_indexes([gold_masses])
+  gold_index_lists, gold_m = masses_to_indexes(gold_masses_list)
   assert gold_m == m
-  return [ pi(c, gold_indexes, m) for c in index_lists ]
+  return pi_matrix(index_lists, gold_index_lists, m).tolist()
+
+def gold_pis(task):
+  "Calculate `golds_pis` for a (segmentations, gold masses list) pair."
+  return golds_pis(*task)
 
 def mean(s):
   return sum(s) / float(len(s))
@@ -48,20 +86,45 @@ def main():
   p.add_argument(
     'filename', help='name of the JSON segmentation file')
   p.add_argument(
-    'gold', help='name of the gold segmentation file')
+    'gold', nargs='+', 
+    help='name of the gold segmentation file (or files, to compare them)')
+  p.add_argument(
+    '-j', '--jobs', metavar='J', type=int, default=1, 
+    help='number of worker processes to use')
   args = p.parse_args()
   o = load_segmentation_data(args.filename)
-  g = load_segmentation_data(args.gold)['items']
-  all_pis = { i: pis(segmentations.values(), g[i]['gold'])
-              for i, segmentations in sorted(o['items'].items()) }
-  means = { i: mean(pis) for i,pis in all_pis.items() }
+  golds = [ load_segmentation_data(f)['items'] for f in args.gold ]
+  doc_ids = sorted(o['items'])
+  tasks = [ (o['items'][i].values(), [ g[i]['gold'] for g in golds ]) 
+            for i in doc_ids ]
+  results = balanced_map(
+    gold_pis, tasks, [ task_size(s) for s,gold in tasks ], args.jobs)
   print '''
 Mean strict agreement with a "gold" segmentation, where agreement is
 modeled as a coder making the same judgment as the majority.
 '''
   print 'Mean π:\n'
-  print_coefficients(means)
-  print '\nOverall: {:.2f}'.format(mean(list(chain(*all_pis.values()))))
+  if len(golds) == 1:
+    means = { i:(mean(pis), None) for i,[pis] in zip(doc_ids, results) }
+    print_coefficients(means)
+    print '\nOverall: {:.2f}'.format(
+      mean(list(chain(*[ pis for [pis] in results ]))))
+  else:
+    show_comparison([ os.path.basename(f) for f in args.gold ], 
+                    doc_ids, results)
+
+def show_comparison(titles, doc_ids, results):
+  "Print a column of mean π for each gold segmentation."
+  def row(label, cells):
+    print '{:<12}'.format(label) + ''.join(
+      '{:>16}'.format(cell[-15:]) for cell in cells)
+  row('', titles)
+  print
+  for doc_id, golds in zip(doc_ids, results):
+    row(doc_id.split(':')[-1], [ '{:.2f}'.format(mean(pis)) for pis in golds ])
+  print
+  row('Overall', [ '{:.2f}'.format(mean(list(chain(*pis))))
+                   for pis in zip(*results) ])
   
 if __name__ == "__main__":
   main()
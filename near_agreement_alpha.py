@@ -2,54 +2,163 @@
 # -*- coding: utf-8 -*-
 
 from argparse import ArgumentParser
-from itertools import permutations
+from bootstrap import bootstrap_variance
+from functools import partial
 from utils import *
 from windowdiff import *
 
-def pairwise_distance(judgments):
+def interval_distances(label_totals):
+  """
+  Given the total count of each label (number of boundaries), return
+  the labels × labels array of squared interval distances between
+  labels: the squared difference of their numbers of boundaries.
+  """
+  labels = numpy.arange(len(label_totals))
+  return (labels[:,numpy.newaxis] - labels)**2
+
+def ordinal_distances(label_totals):
+  """
+  Given the total count of each label (number of boundaries), return
+  the labels × labels array of squared ordinal distances between
+  labels, which depend on how many judgments fell between them:
+  Krippendorf's (sum of the counts of labels g to h, less half the
+  counts of g and h) squared.
+  """
+  cumulative = numpy.concatenate(([0], numpy.cumsum(label_totals)))
+  g = numpy.arange(len(label_totals))[:,numpy.newaxis]
+  h = numpy.arange(len(label_totals))
+  low, high = numpy.minimum(g, h), numpy.maximum(g, h)
+  between = (cumulative[high+1] - cumulative[low] 
+             - (label_totals[low] + label_totals[high]) / 2.0)
+  return numpy.where(g == h, 0, between**2)
+
+def nominal_distances(label_totals):
+  """
+  Given the total count of each label (number of boundaries), return
+  the labels × labels array of nominal distances between labels: 0 for
+  the same label, and 1 for different labels.
+  """
+  labels = numpy.arange(len(label_totals))
+  return (labels[:,numpy.newaxis] != labels).astype(int)
+
+DISTANCES = { 'interval': interval_distances, 
+              'ordinal': ordinal_distances, 
+              'nominal': nominal_distances }
+
+def window_distances(judgments, distances=None):
+  """
+  Given a windows × labels array of counts of label (number of
+  boundaries) judgments, calculate the pairwise distance within each
+  window: sum over ordered pairs of labels of (label distance *
+  product of label counts). The labels × labels array of `distances`
+  defaults to squared interval distances.
+  """
+  if distances is None:
+    distances = interval_distances(judgments.T)
+  return (judgments.dot(distances) * judgments).sum(axis=-1)
+
+def pairwise_distance(judgments, distances=None):
   """
   Given counts of label (number of boundaries) judgments, calculate
   the pairwise distance: sum over ordered pairs of labels of (label
   distance * product of label counts).
   """
-  return sum([ judgments[a] * judgments[b] * ((a-b)**2)
-        for a,b in permutations(judgments.keys(), 2) ])
+  return window_distances(judgments, distances)[()]
 
-def observed_disagreement(c, judgments):
+def observed_disagreement(c, judgments, counts, distances=None):
   """
-  Given a count `c` of coders, and counts of labels (number of
-  boundaries judgments) for a list of windows, calculate the observed
-  disagreement according to Krippendorf's α.
+  Given a count `c` of coders, the distinct rows `judgments` of a
+  windows × labels array of counts of labels (number of boundaries
+  judgments), and the number of windows `counts` having each row,
+  calculate the observed disagreement according to Krippendorf's α.
   """
-  return (sum([ pairwise_distance(j) for j in judgments ]) 
-          / float(len(judgments)*c*(c-1)))
+  return (counts.dot(window_distances(judgments, distances))
+          / float(counts.sum()*c*(c-1)))
 
-def expected_disagreement(c, judgments):
+def expected_disagreement(c, judgments, counts, distances=None):
   """
-  Given a count `c` of coders, and counts of labels (number of
-  boundaries judgments) for a list of windows, calculate the expected
-  disagreement according to Krippendorf's α.
+  Given a count `c` of coders, the distinct rows `judgments` of a
+  windows × labels array of counts of labels (number of boundaries
+  judgments), and the number of windows `counts` having each row,
+  calculate the expected disagreement according to Krippendorf's α.
   """
-  label_totals = reduce(lambda x,y: x+y, judgments)
-  total_judgments = len(judgments)*c 
-  return (pairwise_distance(label_totals)
+  label_totals = counts.dot(judgments)
+  total_judgments = counts.sum()*c 
+  return (pairwise_distance(label_totals, distances)
           / float(total_judgments*(total_judgments-1)))
 
-def near_agreement(segmentations, k=None):
+def alpha(c, judgments, counts, distance=interval_distances):
+  """
+  Given a count `c` of coders, the distinct rows `judgments` of a
+  windows × labels array of counts of labels, and the number of
+  windows `counts` having each row, calculate Krippendorf's α. The
+  `distance` function returns the labels × labels array of distances
+  given the label totals (see `DISTANCES`).
+  """
+  distances = distance(counts.dot(judgments))
+  o = observed_disagreement(c, judgments, counts, distances)
+  e = expected_disagreement(c, judgments, counts, distances)
+  return 1 - (o/e)
+
+def near_agreement(segmentations, k=None, replicates=0, seed=0, jobs=1,
+                   distance=interval_distances):
   """
   Given coders' segmentations (represented as segment masses),
-  calculate agreement on boundary counts within windows.
+  calculate agreement on boundary counts within windows, with the
+  label `distance` function given (see `alpha`). If a number of
+  bootstrap `replicates` is given, estimate the variance by
+  resampling windows; otherwise the variance is None.
   """
   index_lists, m = masses_to_indexes(segmentations)
   if k is None: k = window_size(segmentations)
-  judgments = count_window_judgments(index_lists, m, k)
-  c = len(segmentations)
-  o = observed_disagreement(c, judgments)
-  e = expected_disagreement(c, judgments)
-  agreement = 1 - (o/e)
-  variance = None # need bootstrap to calculate this
+  judgments = window_judgments(index_lists, m, k)
+  return judgments_alpha(len(segmentations), judgments, 
+                         replicates, seed, jobs, distance)
+
+def judgments_alpha(c, judgments, replicates=0, seed=0, jobs=1, 
+                    distance=interval_distances):
+  """
+  Given a count `c` of coders and a windows × labels array of counts
+  of labels (number of boundaries judgments), calculate agreement on
+  boundary counts within windows using Krippendorf's α, and return
+  the coefficient and its variance (see `near_agreement`).
+  """
+  judgments, counts = distinct_windows(judgments)
+  return windows_alpha(c, judgments, counts, replicates, seed, jobs, 
+                       distance)
+
+def windows_alpha(c, judgments, counts, replicates=0, seed=0, jobs=1,
+                  distance=interval_distances):
+  """
+  Like `judgments_alpha`, but given the distinct rows `judgments` of a
+  windows × labels array, in lexicographic order, and the number of
+  windows `counts` having each row.
+  """
+  agreement = alpha(c, judgments, counts, distance)
+  if replicates:
+    variance = bootstrap_variance(
+      partial(alpha, c, judgments, distance=distance), counts, 
+      replicates, seed, jobs)
+  else:
+    variance = None
   return agreement, variance
 
+def accumulated_alpha(accumulator, replicates=0, seed=0, jobs=1,
+                      distance=interval_distances):
+  "Calculate `windows_alpha` for a `WindowAccumulator`."
+  return windows_alpha(accumulator.c, accumulator.judgments, 
+                       accumulator.counts, replicates, seed, jobs, distance)
+
+def document_alpha(k, overall_k, segmentations, replicates=0, seed=0, 
+                   jobs=1, distance=interval_distances):
+  """
+  Calculate `near_agreement` for a document, and return it along with
+  the document's `WindowAccumulator` for windows of size `overall_k`.
+  """
+  windows, overall_windows = document_windows(k, overall_k, segmentations)
+  return (accumulated_alpha(windows, replicates, seed, jobs, distance), 
+          overall_windows)
+
 def parse_args():
   p = ArgumentParser(description=main.__doc__)
   p.add_argument(
@@ -59,7 +168,31 @@ def parse_args():
     action='append', dest='coders')
   p.add_argument(
     '--reference', help='name of the reference annotator used to calculate k')
-  return p.parse_args()
+  p.add_argument(
+    '--bootstrap', metavar='N', type=int, default=0, 
+    help='estimate variance from N bootstrap replicates')
+  p.add_argument(
+    '-j', '--jobs', metavar='J', type=int, default=1, 
+    help='number of worker processes to use')
+  p.add_argument(
+    '--seed', type=int, default=0, help='random seed for bootstrapping')
+  p.add_argument(
+    '--distance', choices=sorted(DISTANCES), default='interval',
+    help='distance between labels (numbers of boundaries); default interval')
+  p.add_argument(
+    '--sweep', metavar='kmin:kmax', type=window_sizes,
+    help='calculate agreement for each window size from kmin to kmax')
+  p.add_argument(
+    '--plot', metavar='svg', 
+    help='with --sweep, also plot agreement against window size as SVG')
+  args = p.parse_args()
+  if args.bootstrap == 1 or args.bootstrap < 0:
+    p.error('--bootstrap needs at least 2 replicates')
+  if args.sweep and (args.bootstrap or args.seed or args.reference):
+    p.error('--sweep cannot be used with --bootstrap, --seed or --reference')
+  if args.plot and not args.sweep:
+    p.error('--plot needs --sweep')
+  return args
 
 def reference_k(items, reference):
   reference_segmentations = [ s[reference] for s in items.values() ]
@@ -70,17 +203,37 @@ def main():
   args = parse_args()
   o = load_segmentation_data(args.filename)
   items = filter_coders(o['items'], args.coders) if args.coders else o['items']
-  agreement = (near_agreement if args.reference is None 
-               else partial(near_agreement, 
-                            k=reference_k(items, args.reference)))
+  if args.reference is None:
+    k = None
+    overall_k = combined_window_size(document_segmentations(items)[1])
+  else:
+    k = overall_k = reference_k(items, args.reference)
+  options = dict(replicates=args.bootstrap, seed=args.seed, jobs=args.jobs,
+                 distance=DISTANCES[args.distance])
   print '''
 Near segmentation agreement (Krippendorf's α), where agreement is
 modeled as two annotators counting the same number of boundaries
 within a window (i.e. WindowDiff):
 '''
-  print_coefficients(per_document_coefficients(items, agreement))
-  print '\nOverall agreement: {:.2f}\n'.format(
-    overall_coefficient(items, agreement))
+  if args.sweep:
+    alpha = partial(accumulated_alpha, **options)
+    per_document, overall = accumulated_results(
+      items, partial(document_sweep, alpha, args.sweep), 
+      partial(sweep_coefficients, alpha), args.jobs)
+    print_sweep(args.sweep, per_document, overall)
+    print
+    if args.plot:
+      from plots import plot_sweep
+      plot_sweep(args.sweep, per_document, overall, args.plot, 
+                 r'near $\alpha$')
+    return
+  per_document, overall = accumulated_results(
+    items, partial(document_alpha, k, overall_k, **options),
+    partial(accumulated_alpha, **options), args.jobs)
+  print_coefficients(per_document)
+  print
+  print_coefficient('Overall agreement', *overall)
+  print
 
 if __name__ == "__main__":
   main()
@@ -6,34 +6,32 @@ from functools import partial
 from utils import *
 from windowdiff import *
 
-def pairwise_agreement(c, k, judgments):
+def pairwise_agreement(c, judgments):
   """
-  Given a count `c` of coders, a window size `k`, and counts of label
-  (number of boundaries) judgments for a window, calculate the
-  pairwise agreement on that window: the proportion of agreeing
-  judgment pairs out of the total number of judgment pairs for that
-  window.
+  Given a count `c` of coders and a windows × labels array of counts
+  of label (number of boundaries) judgments, calculate the pairwise
+  agreement on each window: the proportion of agreeing judgment pairs
+  out of the total number of judgment pairs for that window.
   """
-  return (sum([ judgments[label]*(judgments[label]-1) for label in range(k+1) ])
-          / float(c*(c-1)))
+  return (judgments*(judgments-1)).sum(axis=-1) / float(c*(c-1))
 
-def observed_agreement(c, k, judgments):
+def observed_agreement(c, judgments):
   """
-  Given a count `c` of coders, a window size `k`, and counts of
-  labels (number of boundaries judgments) for a list of windows,
-  calculate the observed agreement.
+  Given a count `c` of coders and a windows × labels array of counts
+  of labels (number of boundaries judgments), calculate the observed
+  agreement.
   """
-  window_agreements = [ pairwise_agreement(c, k, j) for j in judgments ]
-  return sum(window_agreements) / len(window_agreements)
+  agreeing_pairs = (judgments*(judgments-1)).sum()
+  return agreeing_pairs / float(c*(c-1)*len(judgments))
 
 def expected_agreement_pi(judgments):
   """
-  Given counts of labels (number of boundaries judgments) for a list
-  of windows, calculate the expected (due to chance) agreement
-  according to Fleiss’s multi-π.
+  Given a windows × labels array of counts of labels (number of
+  boundaries judgments), calculate the expected (due to chance)
+  agreement according to Fleiss’s multi-π.
   """
-  label_totals = reduce(lambda x,y: x+y, judgments).values()
-  return sum([ n**2 for n in label_totals ]) / float(sum(label_totals))**2
+  label_totals = judgments.sum(axis=0)
+  return int((label_totals**2).sum()) / float(label_totals.sum())**2
 
 def near_agreement(segmentations, k=None, 
                    expected_agreement=expected_agreement_pi):
@@ -43,11 +41,43 @@ def near_agreement(segmentations, k=None,
   """
   index_lists, m = masses_to_indexes(segmentations)
   if k is None: k = window_size(segmentations)
-  judgments = count_window_judgments(index_lists, m, k)
-  c = len(segmentations)
-  o = observed_agreement(c, k, judgments)
-  e = expected_agreement_pi(judgments)
-  return (o-e) / (1-e)
+  judgments = window_judgments(index_lists, m, k)
+  return judgments_multi_pi(len(segmentations), judgments)
+
+def judgments_multi_pi(c, judgments):
+  """
+  Given a count `c` of coders and a windows × labels array of counts
+  of labels (number of boundaries judgments), calculate agreement on
+  boundary counts within windows using Fleiss’s multi-π, and return
+  the coefficient and its variance (which is not known, so None).
+  """
+  return windows_multi_pi(
+    c, judgments, numpy.ones(len(judgments), dtype=int))
+
+def windows_multi_pi(c, judgments, counts):
+  """
+  Like `judgments_multi_pi`, but given the distinct rows `judgments`
+  of a windows × labels array and the number of windows `counts`
+  having each row.
+  """
+  agreeing_pairs = counts.dot((judgments*(judgments-1)).sum(axis=-1))
+  o = agreeing_pairs / float(c*(c-1)*counts.sum())
+  label_totals = counts.dot(judgments)
+  e = int((label_totals**2).sum()) / float(label_totals.sum())**2
+  return (o-e) / (1-e), None
+
+def accumulated_multi_pi(accumulator):
+  "Calculate `windows_multi_pi` for a `WindowAccumulator`."
+  return windows_multi_pi(
+    accumulator.c, accumulator.judgments, accumulator.counts)
+
+def document_multi_pi(k, overall_k, segmentations):
+  """
+  Calculate `near_agreement` for a document, and return it along with
+  the document's `WindowAccumulator` for windows of size `overall_k`.
+  """
+  windows, overall_windows = document_windows(k, overall_k, segmentations)
+  return accumulated_multi_pi(windows), overall_windows
 
 def main():
   "Calculates near segmentation agreement using Fleiss’s multi-π."
@@ -56,25 +86,54 @@ def main():
     'filename', help='name of the JSON segmentation file')
   p.add_argument(
     '--reference', help='name of the reference annotator used to calculate k')
+  p.add_argument(
+    '-j', '--jobs', metavar='J', type=int, default=1, 
+    help='number of worker processes to use')
+  p.add_argument(
+    '--sweep', metavar='kmin:kmax', type=window_sizes,
+    help='calculate agreement for each window size from kmin to kmax')
+  p.add_argument(
+    '--plot', metavar='svg', 
+    help='with --sweep, also plot agreement against window size as SVG')
   args = p.parse_args()
+  if args.sweep and args.reference:
+    p.error('--sweep cannot be used with --reference')
+  if args.plot and not args.sweep:
+    p.error('--plot needs --sweep')
   o = load_segmentation_data(args.filename)
   if args.reference is None:
     # Calculate window size per document
-    agreement = near_agreement
+    k = None
+    overall_k = combined_window_size(
+      document_segmentations(o['items'])[1])
   else:
     # Use one window size across all documents
     ra = 'annotators:{}'.format(args.reference)
     reference_segmentations = [ s[ra] for s in o['items'].values() ]
-    k = int(round(mean_segment_mass(reference_segmentations) / 2))
-    agreement = partial(near_agreement, k=k)
+    k = overall_k = int(round(mean_segment_mass(reference_segmentations) / 2))
   print '''
 Near segmentation agreement (Fleiss’s multi-π), where agreement is
 modeled as two annotators counting the same number of boundaries
 within a window (i.e. WindowDiff):
 '''
-  print_coefficients(per_document_coefficients(o['items'], agreement))
-  print '\nOverall agreement: {:.2f}\n'.format(
-    overall_coefficient(o['items'], agreement))
+  if args.sweep:
+    per_document, overall = accumulated_results(
+      o['items'], partial(document_sweep, accumulated_multi_pi, args.sweep),
+      partial(sweep_coefficients, accumulated_multi_pi), args.jobs)
+    print_sweep(args.sweep, per_document, overall)
+    print
+    if args.plot:
+      from plots import plot_sweep
+      plot_sweep(args.sweep, per_document, overall, args.plot, 
+                 r'near multi-$\pi$')
+    return
+  per_document, overall = accumulated_results(
+    o['items'], partial(document_multi_pi, k, overall_k), 
+    accumulated_multi_pi, args.jobs)
+  print_coefficients(per_document)
+  print
+  print_coefficient('Overall agreement', *overall)
+  print
 
 if __name__ == "__main__":
   main()
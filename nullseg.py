@@ -7,20 +7,23 @@ from utils import *
 def parse_args():
   p = ArgumentParser(description=main.__doc__)
   p.add_argument('filename', help='name of the JSON segmentation file')
+  p.add_argument(
+    '--ndjson', action='store_true',
+    help='write one document per line as soon as it is ready')
   return p.parse_args()
 
+def null_segmentation(segmentations):
+  masses = list(set([ sum(m) for m in segmentations.values() ]))
+  assert len(masses) == 1
+  return { 'null':masses }
+
 def main():
   "Produce a null (no boundaries) segmentation for comparison purposes."
   args = parse_args()
-  o = load_segmentation_data(args.filename)
-  items =  { d:{ 'null':list(set([ sum(m) for m in s.values() ])) }
-             for d,s in o['items'].items() }
-  assert all(len(v['null']) == 1 for v in items.values())
-  null = {
-    'segmentation_type': 'linear',
-    'id': 'null',
-    'items': items }
-  print json.dumps(null, sort_keys=True)
+  items = ( (d, null_segmentation(s)) 
+            for d,s in read_segmentation_data(args.filename) )
+  write_segmentation_data(
+    { 'segmentation_type': 'linear', 'id': 'null' }, items, args.ndjson)
   
 if __name__ == "__main__":
   main()
@@ -25,6 +25,20 @@ def merge_results(*results):
   return zip(*sorted(zip(keys[0], *values), 
                      key=lambda x: median(zip(*x[1:])[0])))
 
+def plot_sweep(ks, per_document, overall, svg, label):
+  """
+  Plot coefficients against the window sizes `ks`, with a grey line
+  for each document and a black one for all of them, and save the
+  figure to the file `svg`.
+  """
+  for doc, values in sorted(per_document.items()):
+    plt.plot(ks, [ c for c,v in values ], color='0.75', label='_nolegend_')
+  plt.plot(ks, [ c for c,v in overall ], color='black', label=label)
+  plt.xlim(ks[0], ks[-1])
+  plt.xlabel('window size ($k$)')
+  plt.legend(loc='lower right')
+  plt.savefig(svg, format='svg', transparent=True)
+
 def main():
   args = parse_args()
   o = load_segmentation_data(args.filename)
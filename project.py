@@ -1,24 +1,57 @@
 #! /usr/bin/env python
 
 import json
+import numpy
 from argparse import ArgumentParser
 from utils import *
 
-def closest(v,l):
-  "closet value to v in l"
-  return min(l, key=lambda x: abs(x-v))
+# which of two equally close boundaries a boundary is projected onto
+TIES = ('earlier', 'later')
 
-def project(masses, onto_masses):
-  indexes, m = masslist_to_indexlist(masses)
-  onto_indexes, onto_m = masslist_to_indexlist(onto_masses)
-  assert m == onto_m
-  return indexlist_to_masslist(
-    sorted(set(closest(i,onto_indexes) for i in indexes)), m)
+def closest(indexes, onto_indexes, ties='earlier'):
+  """
+  Given sorted boundary indexes and sorted boundary indexes to project
+  them onto, return an array of the closest of the `onto_indexes` to
+  each index, with `ties` broken toward the earlier or later one.
+  """
+  onto = numpy.asarray(onto_indexes)
+  indexes = numpy.asarray(indexes)
+  after = numpy.searchsorted(onto, indexes).clip(0, len(onto)-1)
+  before = (after - 1).clip(0, len(onto)-1)
+  to_after, to_before = onto[after] - indexes, indexes - onto[before]
+  later = to_after <= to_before if ties == 'later' else to_after < to_before
+  return numpy.where(later, onto[after], onto[before])
 
-def project_items(items, onto):
-  return { doc_id:{ c:project(l, onto[doc_id].values()[0]) 
-                    for c,l in items[doc_id].items() }
-           for doc_id in items }
+def project_segmentations(segmentations, onto_masses, ties='earlier'):
+  """
+  Project a ``{coder:segmentation}`` dict onto the boundaries of a
+  segmentation, snapping the boundaries of all the coders at once.
+  Boundaries projected onto the same boundary are merged.
+  """
+  onto_indexes, m = masslist_to_indexlist(onto_masses)
+  coders = sorted(segmentations)
+  index_lists, coder_m = masses_to_indexes(
+    [ segmentations[c] for c in coders ])
+  assert m == coder_m
+  if not onto_indexes:
+    return { c:[m] for c in coders }
+  snapped = closest(list(chain(*index_lists)), onto_indexes, ties)
+  ends = numpy.cumsum([ len(l) for l in index_lists ])
+  return { c:indexlist_to_masslist(numpy.unique(s).tolist(), m)
+           for c,s in zip(coders, numpy.split(snapped, ends[:-1])) }
+
+def project(masses, onto_masses, ties='earlier'):
+  return project_segmentations({ None:masses }, onto_masses, ties)[None]
+
+def project_items(items, onto, ties='earlier'):
+  """
+  Given an iterable of ``(doc_id, {coder:segmentation})`` pairs and
+  the items of a file with boundaries to project onto, generate the
+  projected pairs.
+  """
+  for doc_id, segmentations in items:
+    yield doc_id, project_segmentations(
+      segmentations, onto[doc_id].values()[0], ties)
 
 def parse_args():
   p = ArgumentParser(description=main.__doc__)
@@ -26,16 +59,23 @@ def parse_args():
     'segmentations', help='file with segmentations to be projected')
   p.add_argument(
     'boundaries', help='file with boundaries to be projected upon')
+  p.add_argument(
+    '--ndjson', action='store_true',
+    help='write one document per line as soon as it is ready')
+  p.add_argument(
+    '--ties', choices=TIES, default='earlier',
+    help='which of two equally close boundaries to project onto '
+    '(default: earlier)')
   return p.parse_args()
 
 def main():
   args = parse_args()
-  s = load_segmentation_data(args.segmentations)
+  s = read_segmentation_data(args.segmentations)
   b = load_segmentation_data(args.boundaries)
-  o = { 'id':'{}-projected-onto-{}'.format(s['id'],b['id']),
-        'segmentation_type':'linear',
-        'items': project_items(s['items'], b['items']) }
-  print json.dumps(o, sort_keys=True)
+  write_segmentation_data(
+    { 'id':'{}-projected-onto-{}'.format(s.field('id'),b['id']),
+      'segmentation_type':'linear' },
+    project_items(s, b['items'], args.ties), args.ndjson)
 
 if __name__ == "__main__":
   main()
@@ -1,32 +1,151 @@
 #! /usr/bin/env python
+# -*- coding: utf-8 -*-
 
 import json
+import numpy
 from argparse import ArgumentParser
-from itertools import ifilterfalse
-from random import random
+from collections import Counter
+from functools import partial
+from strict_agreement import MultiPiAccumulator, accumulate_multi_pi
 from utils import *
 
+# below this probability of placing a boundary, random boundaries are
+# placed by drawing the gaps between them rather than testing each
+# potential boundary
+SPARSE = 0.05
+# random numbers drawn at a time when generating boundaries
+BLOCK = 1 << 16
+
 def parse_args():
   p = ArgumentParser(description=main.__doc__)
   p.add_argument('filename', help='name of the JSON segmentation file')
+  p.add_argument(
+    '--ndjson', action='store_true',
+    help='write one document per line as soon as it is ready')
+  p.add_argument(
+    '-b', '--baselines', metavar='N', type=int, 
+    help='instead of writing a random segmentation, report percentiles of '
+    'multi-π over N random segmentations, each added to the coders')
+  p.add_argument(
+    '-p', '--percentile', metavar='P', type=float, action='append',
+    dest='percentiles', help='percentile of the random baselines to report '
+    '(default: 5, 50 and 95)')
+  p.add_argument(
+    '--seed', type=int, default=0, help='random seed for the baselines')
+  p.add_argument(
+    '-j', '--jobs', metavar='J', type=int, default=1,
+    help='number of worker processes to use')
   return p.parse_args()
 
-def proportion_of_boundaries(items):
-  index_lists, m = masses_to_indexes(overall_segmentations(items))
-  boundaries_placed = sum(len(l) for l in index_lists)
-  possible_boundaries = m - len(items)
+def proportion_of_boundaries(documents):
+  """
+  Given an iterable of ``{coder:segmentation}`` dicts, return the
+  proportion of potential boundaries at which coders placed boundaries,
+  treating each coder's segmentations as if they were concatenated.
+  """
+  segments = Counter()
+  mass = 0
+  for count, segmentations in enumerate(documents, start=1):
+    segments.update({ c:len(s) for c,s in segmentations.items() })
+    mass += total_mass(segmentations)
+  boundaries_placed = sum(segments.values()) - len(segments)
+  possible_boundaries = mass - count
   return boundaries_placed / float(possible_boundaries)
 
-def random_segments(m, p_boundary):
+def random_boundaries(rng, length, p_boundary):
+  """
+  Generate arrays of the positions, in order, of boundaries placed
+  independently with probability `p_boundary` at each of `length`
+  positions, using the random number generator `rng`. Each potential
+  boundary is tested, unless boundaries are `SPARSE`, in which case
+  the gaps between them are drawn from a geometric distribution.
+  """
+  if p_boundary <= 0:
+    return
+  if p_boundary < SPARSE:
+    last = -1
+    while last < length:
+      positions = last + numpy.cumsum(rng.geometric(p_boundary, BLOCK))
+      last = positions[-1]
+      yield positions[positions < length]
+  else:
+    for start in range(0, length, BLOCK):
+      yield start + numpy.flatnonzero(
+        rng.random_sample(min(BLOCK, length-start)) < p_boundary)
+
+def random_segments(m, p_boundary, rng=numpy.random):
   """
   Given a total mass and a probability of placing a boundary, return a
   randomly-generated list of segment masses.
   """
-  indexes = list(ifilterfalse(lambda x: x is None, (
-        (i if random() < p_boundary else None) for i in range(1, m) )))
-  [masses] = indexes_to_masses([indexes], m)
+  indexes = numpy.concatenate(
+    [[]] + list(random_boundaries(rng, m-1, p_boundary))) + 1
+  [masses] = indexes_to_masses([indexes.astype(int).tolist()], m)
   return masses
 
+def chance_multi_pi(p_boundary, replicates, seed, task):
+  """
+  Given a document's index and its coders' segmentations, return the
+  `MultiPiAccumulator` of the coders' judgments and one whose counts
+  are arrays, holding the statistics of each of `replicates` random
+  segmentations added to the coders'. The random boundaries of all the
+  replicates are drawn as one sequence, from a random stream
+  determined by `seed` and the document's index.
+  """
+  index, segmentations = task
+  index_lists, m = masses_to_indexes(segmentations)
+  judgments = boundary_counts(index_lists, m)
+  coders = accumulate_multi_pi(segmentations)[1]
+  c, i = len(segmentations) + 1, m - 1
+  agreeing_pairs = lambda n: n*(n-1) + (c-n)*(c-n-1)
+  # the agreeing pairs a random boundary adds at each potential boundary
+  gain = agreeing_pairs(judgments + 1) - agreeing_pairs(judgments)
+  pairs = numpy.repeat(float(agreeing_pairs(judgments).sum()), replicates)
+  n = numpy.repeat(int(judgments.sum()), replicates)
+  if i > 0:
+    rng = numpy.random.RandomState([seed, index])
+    for positions in random_boundaries(rng, replicates*i, p_boundary):
+      replicate, boundary = numpy.divmod(positions, i)
+      pairs += numpy.bincount(replicate, weights=gain[boundary], 
+                              minlength=replicates)
+      n += numpy.bincount(replicate, minlength=replicates)
+  return coders, MultiPiAccumulator(c, i, pairs, n)
+
+def chance_baselines(documents, p_boundary, replicates, seed=0, jobs=1):
+  """
+  Return the multi-π of each document's coders and that of the
+  concatenated documents, each with an array of the multi-π values
+  with each of `replicates` random segmentations added to the coders.
+  """
+  doc_ids, segmentations = document_segmentations(documents)
+  results = balanced_map(
+    partial(chance_multi_pi, p_boundary, replicates, seed),
+    list(enumerate(segmentations)), map(task_size, segmentations), jobs)
+  per_document = { d:(coders.coefficient()[0], chance.coefficient()[0])
+                   for d,(coders,chance) in zip(doc_ids, results) }
+  overall = tuple(merge_accumulators(list(accumulators)).coefficient()[0]
+                  for accumulators in zip(*results))
+  return per_document, overall
+
+def show_baselines(per_document, overall, replicates, percentiles):
+  def row(label, cells):
+    print (u'{:<12}'.format(label) + u''.join(
+        u'{:>10}'.format(cell) for cell in cells)).encode('utf-8')
+  def baselines_row(label, (coders, chance)):
+    row(label, [ '{:.2f}'.format(coders) ] + [ '{:.2f}'.format(x) for x in 
+        numpy.percentile(chance[numpy.isfinite(chance)], percentiles) ])
+  print u'''
+Multi-π of the coders, and percentiles of multi-π with a random coder
+added, over {} random segmentations.
+'''.format(replicates).encode('utf-8')
+  row('', [ u'coders' ] + [ u'{:g}%'.format(p) for p in percentiles ])
+  print
+  for doc_id, d in sorted(per_document.items()):
+    baselines_row(doc_id.split(':')[-1], d)
+  print
+  baselines_row('Overall', overall)
+  print
+
 def total_mass(segmentations):
   total_masses = list(set([ sum(m) for m in segmentations.values() ]))
   assert len(total_masses) == 1
@@ -35,15 +154,26 @@ def total_mass(segmentations):
 def main():
   "Produce a random segmentation for comparison purposes."
   args = parse_args()
-  o = load_segmentation_data(args.filename)
-  p_boundary = proportion_of_boundaries(o['items'])
-  items = { d:{ 'random':random_segments(total_mass(s), p_boundary) }
-            for d,s in o['items'].items() }
-  rand = {
-    'segmentation_type': 'linear',
-    'id': 'random',
-    'items': items }
-  print json.dumps(rand, sort_keys=True)
+  if args.baselines:
+    documents = load_segmentation_data(args.filename)['items']
+    p_boundary = proportion_of_boundaries(documents.values())
+    per_document, overall = chance_baselines(
+      documents, p_boundary, args.baselines, args.seed, args.jobs)
+    show_baselines(per_document, overall, args.baselines,
+                   args.percentiles or [5, 50, 95])
+    return
+  # read the input once (it may be stdin), keeping each document's mass
+  # to generate from once the proportion of boundaries is known
+  masses = []
+  def documents():
+    for d,s in read_segmentation_data(args.filename):
+      masses.append((d, total_mass(s)))
+      yield s
+  p_boundary = proportion_of_boundaries(documents())
+  items = ( (d, { 'random':random_segments(m, p_boundary) }) 
+            for d,m in masses )
+  write_segmentation_data(
+    { 'segmentation_type': 'linear', 'id': 'random' }, items, args.ndjson)
   
 if __name__ == "__main__":
   main()
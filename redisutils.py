@@ -0,0 +1,85 @@
+import redis
+import time
+from multiprocessing.pool import ThreadPool
+
+BATCH_SIZE = 1000
+
+def connect(**kwargs):
+  """
+  Return a Redis client. Clients are safe to share between threads:
+  each command takes a connection from the client's connection pool.
+  """
+  return redis.StrictRedis(
+    connection_pool=redis.ConnectionPool(**kwargs))
+
+def pipelined(r, command, args_list, batch_size=BATCH_SIZE):
+  """
+  Run the named Redis `command` once for each tuple of arguments in
+  `args_list`, sending the commands in pipelines of `batch_size`, and
+  return the list of replies.
+  """
+  replies = []
+  for i in range(0, len(args_list), batch_size):
+    pipe = r.pipeline(transaction=False)
+    for args in args_list[i:i+batch_size]:
+      getattr(pipe, command)(*args)
+    replies.extend(pipe.execute())
+  return replies
+
+def map_interviews(f, interviews, jobs=1):
+  """
+  Map `f` over `interviews`, fetching up to `jobs` of them concurrently,
+  and return the results in order.
+  """
+  if jobs == 1:
+    return map(f, interviews)
+  pool = ThreadPool(jobs)
+  try:
+    return pool.map(f, interviews)
+  finally:
+    pool.close()
+
+class BulkWriter(object):
+  """
+  Stage writes and send them to Redis in pipelined MULTI/EXEC
+  transactions of about `batch_size` commands. A group of commands
+  staged together (e.g. replacing a list) is never split between
+  transactions. Counts of commands and the time spent sending them
+  are kept for reporting throughput.
+  """
+  def __init__(self, r, batch_size=BATCH_SIZE):
+    self.r = r
+    self.batch_size = batch_size
+    self.staged = []
+    self.commands = 0
+    self.seconds = 0.0
+
+  def stage(self, *commands):
+    "Stage a group of ``(command, args)`` pairs."
+    if len(self.staged) + len(commands) > self.batch_size:
+      self.flush()
+    self.staged.extend(commands)
+
+  def hmset(self, key, mapping):
+    self.stage(('hmset', (key, mapping)))
+
+  def replace_list(self, key, values):
+    "Replace the list at `key` with `values`."
+    self.stage(('delete', (key,)), ('rpush', (key,) + tuple(values)))
+
+  def flush(self):
+    if not self.staged:
+      return
+    start = time.time()
+    pipe = self.r.pipeline(transaction=True)
+    for command, args in self.staged:
+      getattr(pipe, command)(*args)
+    pipe.execute()
+    self.seconds += time.time() - start
+    self.commands += len(self.staged)
+    self.staged = []
+
+  def report(self):
+    return '{} commands in {:.2f}s ({:.0f} commands/s)'.format(
+      self.commands, self.seconds, 
+      self.commands / self.seconds if self.seconds else 0)
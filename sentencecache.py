@@ -0,0 +1,82 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sentences (
+  key TEXT PRIMARY KEY,
+  sentences TEXT NOT NULL,
+  used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sentences_used ON sentences (used);
+'''
+
+class SentenceCache(object):
+  """
+  A durable cache of sentence splits, stored in a sqlite database and
+  keyed by a hash of the cleaned paragraph text and the `version` of
+  the splitter. Each thread has its own connection; the database is in
+  WAL mode, so concurrent runs can read while one writes. Results are
+  written as they are added rather than when a run ends. If
+  `max_entries` is given, the least recently used entries are evicted
+  to keep the cache at that size.
+  """
+  def __init__(self, filename='cache.sqlite', version='', max_entries=None):
+    self.filename = filename
+    self.version = version
+    self.max_entries = max_entries
+    self.local = threading.local()
+    with self.connection() as db:
+      db.executescript(SCHEMA)
+
+  def connection(self):
+    if not hasattr(self.local, 'db'):
+      db = sqlite3.connect(self.filename, timeout=60)
+      db.execute('PRAGMA journal_mode=WAL')
+      self.local.db = db
+    return self.local.db
+
+  def key(self, text):
+    return hashlib.sha1(u'{}\0{}'.format(self.version, text)
+                        .encode('utf-8')).hexdigest()
+
+  def clock(self, db):
+    "A counter that orders uses of the cache, for eviction."
+    [(used,)] = db.execute('SELECT COALESCE(MAX(used), 0) FROM sentences')
+    return used + 1
+
+  def get_many(self, texts):
+    "Return a dict of the cached sentences of those `texts` in the cache."
+    texts = list(set(texts))
+    keys = dict((self.key(t), t) for t in texts)
+    found = {}
+    with self.connection() as db:
+      # look keys up in groups, staying under sqlite's variable limit
+      for i in range(0, len(texts), 500):
+        group = [ self.key(t) for t in texts[i:i+500] ]
+        found.update(db.execute(
+            'SELECT key, sentences FROM sentences WHERE key IN ({})'.format(
+              ','.join('?' * len(group))), group))
+      if found:
+        used = self.clock(db)
+        db.executemany('UPDATE sentences SET used = ? WHERE key = ?',
+                       [ (used, k) for k in found ])
+    return dict((keys[k], json.loads(v)) for k,v in found.items())
+
+  def put_many(self, items):
+    "Add ``(text, sentences)`` pairs to the cache, and commit them."
+    with self.connection() as db:
+      used = self.clock(db)
+      db.executemany(
+        'INSERT OR REPLACE INTO sentences (key, sentences, used) '
+        'VALUES (?, ?, ?)',
+        [ (self.key(t), json.dumps(s), used) for t,s in items ])
+      if self.max_entries is not None:
+        db.execute(
+          'DELETE FROM sentences WHERE key IN (SELECT key FROM sentences '
+          'ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+  def __len__(self):
+    [(count,)] = self.connection().execute('SELECT COUNT(*) FROM sentences')
+    return count
@@ -0,0 +1,170 @@
+#! /usr/bin/env python
+
+import json
+import mmap
+import struct
+import threading
+import zlib
+from argparse import ArgumentParser
+from itertools import chain
+from redisutils import *
+
+# Layout of a snapshot file:
+#
+#   MAGIC, then the header length as a little-endian uint32
+#   header: UTF-8 JSON object with "offsets", mapping each interview ID
+#           to the (offset, length) of its record, and "keys", mapping
+#           each key to the interview whose record holds it
+#   records: for each interview, zlib-compressed UTF-8 JSON object
+#            mapping each of its keys to the key's value
+
+MAGIC = 'SNAP\x00\x02'
+PATTERNS = [ 'interviews:{}:*', 'speechblocks:{}/*', 'speakers:{}/*' ]
+FETCH = { 'list': ('lrange', (0, -1), list),
+          'hash': ('hgetall', (), dict),
+          'set': ('smembers', (), sorted),
+          'string': ('get', (), unicode) }
+
+def interview_of(key):
+  "The interview a key is named for, e.g. U-0005 for interviews:U-0005."
+  return key.split(':')[1].split('/')[0]
+
+def interview_keys(r, interview):
+  "The keys of an interview's lists and of the sentences they refer to."
+  keys = set(chain(*[ r.scan_iter(p.format(interview)) for p in PATTERNS ]))
+  keys.update(r.lrange('interviews:{}:sentences'.format(interview), 0, -1))
+  return sorted(keys)
+
+def fetch(r, keys):
+  """
+  Return a dict of the values of `keys`, using pipelines. Keys that do
+  not exist are left out; keys of types that cannot be fetched (see
+  `FETCH`) raise an exception.
+  """
+  types = pipelined(r, 'type', [ (k,) for k in keys ])
+  unknown = [ (k, t) for k,t in zip(keys, types) 
+              if t not in FETCH and t != 'none' ]
+  if unknown:
+    raise ValueError('cannot snapshot {} (type {})'.format(*unknown[0]))
+  values = {}
+  for t, (command, args, convert) in FETCH.items():
+    typed = [ k for k,key_type in zip(keys, types) if key_type == t ]
+    values.update(zip(typed, map(convert, pipelined(
+            r, command, [ (k,) + args for k in typed ]))))
+  return values
+
+def export(r, interviews, filename, jobs=1):
+  """
+  Write the `interviews`' keys in Redis to a snapshot file, fetching
+  up to `jobs` interviews concurrently.
+  """
+  values = map_interviews(
+    lambda i: fetch(r, interview_keys(r, i)), interviews, jobs)
+  records = [ zlib.compress(json.dumps(v, sort_keys=True)) for v in values ]
+  offsets, keys, position = {}, {}, 0
+  for interview, v, record in zip(interviews, values, records):
+    offsets[interview] = (position, len(record))
+    keys.update((k, interview) for k in v)
+    position += len(record)
+  header = json.dumps({ 'offsets':offsets, 'keys':keys }, sort_keys=True)
+  with open(filename, 'wb') as f:
+    f.write(MAGIC)
+    f.write(struct.pack('<I', len(header)))
+    f.write(header)
+    for record in records:
+      f.write(record)
+
+class Snapshot(object):
+  """
+  Read-only access to a snapshot file, with the subset of the Redis
+  client interface used by the export tools, including pipelines. The
+  file is memory-mapped, and an interview's record is decoded when one
+  of its keys is first read.
+  """
+  def __init__(self, filename):
+    with open(filename, 'rb') as f:
+      self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    assert self.data[:len(MAGIC)] == MAGIC, 'not a snapshot file'
+    [header_length] = struct.unpack(
+      '<I', self.data[len(MAGIC):len(MAGIC)+4])
+    start = len(MAGIC) + 4
+    header = json.loads(self.data[start:start+header_length])
+    self.offsets, self.keys = header['offsets'], header['keys']
+    self.start = start + header_length
+    self.records = {}
+    self.lock = threading.Lock()
+
+  def interviews(self):
+    return sorted(self.offsets)
+
+  def record(self, interview):
+    with self.lock:
+      if interview not in self.records:
+        if interview not in self.offsets:
+          raise KeyError('interview {} is not in the snapshot'.format(
+              interview))
+        offset, length = self.offsets[interview]
+        self.records[interview] = json.loads(zlib.decompress(
+            self.data[self.start+offset:self.start+offset+length]))
+      return self.records[interview]
+
+  def value(self, key):
+    if key not in self.keys:
+      return None
+    return self.record(self.keys[key]).get(key)
+
+  def lrange(self, key, start, end):
+    values = self.value(key) or []
+    return values[start:(None if end == -1 else end+1)]
+
+  def llen(self, key):
+    return len(self.value(key) or [])
+
+  def hget(self, key, field):
+    return (self.value(key) or {}).get(field)
+
+  def hgetall(self, key):
+    return self.value(key) or {}
+
+  def pipeline(self, transaction=True):
+    return Pipeline(self)
+
+class Pipeline(object):
+  "Queue commands on a `Snapshot`, to run when `execute` is called."
+  def __init__(self, snapshot):
+    self.snapshot = snapshot
+    self.commands = []
+  def __getattr__(self, command):
+    return lambda *args: self.commands.append((command, args))
+  def execute(self):
+    results = [ getattr(self.snapshot, command)(*args)
+                for command, args in self.commands ]
+    self.commands = []
+    return results
+
+def connect_or_snapshot(snapshot=None):
+  "A `Snapshot` of the named file if one is given, else a Redis client."
+  return Snapshot(snapshot) if snapshot else connect()
+
+def parse_args():
+  p = ArgumentParser(description=main.__doc__)
+  p.add_argument(
+    'output', help='name of the snapshot file to write')
+  p.add_argument(
+    'interviews', nargs='*',
+    help='interviews to include (default: every interview)')
+  p.add_argument(
+    '-j', '--jobs', metavar='J', type=int, default=4,
+    help='number of interviews to fetch concurrently')
+  return p.parse_args()
+
+def main():
+  "Export interviews, speechblocks and speakers from Redis to a snapshot."
+  args = parse_args()
+  r = connect(decode_responses=True)
+  interviews = args.interviews or sorted(
+    set(interview_of(k) for k in r.scan_iter('interviews:*')))
+  export(r, interviews, args.output, args.jobs)
+
+if __name__ == "__main__":
+  main()
@@ -1,13 +1,15 @@
 #! /usr/bin/env python
 
-import redis
 import json
 from argparse import ArgumentParser
+from functools import partial
+from redisutils import *
+from snapshot import connect_or_snapshot
 from utils import *
 
 def speaker_masses(r, interview):
-  speakers = [ r.hget(s, 'speaker') for s in r.lrange(
-      'interviews:{}:sentences'.format(interview), 0, -1) ]
+  sentences = r.lrange('interviews:{}:sentences'.format(interview), 0, -1)
+  speakers = pipelined(r, 'hget', [ (s, 'speaker') for s in sentences ])
   interviewee = sorted((speakers.count(s),s) for s in set(speakers))[-1][1]
   def compare(pair):
     if interviewee in pair[1] and not pair[1][0] == pair[1][1]:
@@ -24,17 +26,25 @@ def parse_args():
   p = ArgumentParser(description=main.__doc__)
   p.add_argument(
     'interviews', nargs='+', help='interviews to get speaker masses of')
+  p.add_argument(
+    '-j', '--jobs', metavar='J', type=int, default=4, 
+    help='number of interviews to fetch concurrently')
+  p.add_argument(
+    '--snapshot', metavar='filename',
+    help='read from a snapshot file (see snapshot.py) instead of Redis')
   return p.parse_args()
 
 def main():
   args = parse_args()
-  r = redis.StrictRedis()
+  r = connect_or_snapshot(args.snapshot)
+  masses = map_interviews(
+    partial(speaker_masses, r), args.interviews, args.jobs)
   o = { 'id':'speakers', 
         'segmentation_type':'linear',
         'items':
           { 'interviews:{}'.format(interview): 
-            { 'speakers':speaker_masses(r, interview) }
-            for interview in args.interviews }}
+            { 'speakers':m }
+            for interview, m in zip(args.interviews, masses) }}
   print json.dumps(o, sort_keys=True)
 
 if __name__ == "__main__":
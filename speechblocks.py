@@ -1,33 +1,45 @@
 #! /usr/bin/env python
 
-import redis
 import json
 from argparse import ArgumentParser
+from functools import partial
+from redisutils import *
+from snapshot import connect_or_snapshot
 
-def speechblock_mass(r, speechblock):
-  mass = r.llen('{}:sentences'.format(speechblock))
+def check_mass(speechblock, mass):
   assert mass > 0, 'speechblock {} has zero mass'.format(speechblock)
   return mass
 
 def speechblock_masses(r, interview):
-  speechblocks = 'interviews:{}:speechblocks'.format(interview)
-  return [ speechblock_mass(r,k) for k in r.lrange(speechblocks, 0, -1) ]
+  speechblocks = r.lrange(
+    'interviews:{}:speechblocks'.format(interview), 0, -1)
+  masses = pipelined(
+    r, 'llen', [ ('{}:sentences'.format(k),) for k in speechblocks ])
+  return map(check_mass, speechblocks, masses)
 
 def parse_args():
   p = ArgumentParser(description=main.__doc__)
   p.add_argument(
     'interviews', nargs='+', help='interviews to get speechblock masses of')
+  p.add_argument(
+    '-j', '--jobs', metavar='J', type=int, default=4, 
+    help='number of interviews to fetch concurrently')
+  p.add_argument(
+    '--snapshot', metavar='filename',
+    help='read from a snapshot file (see snapshot.py) instead of Redis')
   return p.parse_args()
 
 def main():
   args = parse_args()
-  r = redis.StrictRedis()
+  r = connect_or_snapshot(args.snapshot)
+  masses = map_interviews(
+    partial(speechblock_masses, r), args.interviews, args.jobs)
   o = { 'id':'speechblocks', 
         'segmentation_type':'linear',
         'items':
           { 'interviews:{}'.format(interview): 
-            { 'speechblocks':speechblock_masses(r, interview) }
-            for interview in args.interviews }}
+            { 'speechblocks':m }
+            for interview, m in zip(args.interviews, masses) }}
   print json.dumps(o, sort_keys=True)
 
 if __name__ == "__main__":
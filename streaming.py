@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import json
+import re
+
+WHITESPACE = re.compile(r'\s*')
+CHUNK_SIZE = 1 << 16
+
+class SegmentationReader(object):
+  """
+  Incrementally parse segmentation data from a file object, yielding
+  ``(doc_id, {coder:segmentation})`` pairs from the ``items`` object
+  as they are read, so that only one document needs to be held in
+  memory at a time.
+
+  Two layouts are understood: the usual single JSON object, and NDJSON,
+  where a first line holds the other top-level fields and each
+  following line holds an object with a single document. Top-level
+  fields other than ``items`` are collected in `metadata`; those that
+  precede the documents are available as soon as the reader is made,
+  and `field` finds those that follow them.
+  """
+  def __init__(self, f):
+    self.f = f
+    self.buffer = ''
+    self.position = 0
+    self.decoder = json.JSONDecoder()
+    self.metadata = {}
+    self.documents = self.read()
+    # read up to the first document, so the leading metadata is known
+    self.first = next(self.documents, None)
+
+  def __iter__(self):
+    if self.first is not None:
+      yield self.first
+      self.first = None
+      for document in self.documents:
+        yield document
+
+  def field(self, key, *default):
+    """
+    Return the top-level field `key`, or `default` if there is none.
+    If the field has not been read, the rest of the documents are read
+    and kept, in case it follows them. Call this before iterating.
+    """
+    if key not in self.metadata:
+      self.documents = iter(list(self.documents))
+    if default:
+      return self.metadata.get(key, default[0])
+    return self.metadata[key]
+
+  def read_more(self):
+    "Read more input, at least doubling what is buffered."
+    chunk = self.f.read(max(CHUNK_SIZE, len(self.buffer) - self.position))
+    self.buffer = self.buffer[self.position:] + chunk
+    self.position = 0
+    return len(chunk) > 0
+
+  def peek(self):
+    "Return the next non-whitespace character, or '' at the end."
+    while True:
+      self.position = WHITESPACE.match(self.buffer, self.position).end()
+      if self.position < len(self.buffer) or not self.read_more():
+        return self.buffer[self.position:self.position+1]
+
+  def expect(self, characters):
+    c = self.peek()
+    if c == '' or c not in characters:
+      raise ValueError('expected one of {!r} but found {!r}'.format(
+          characters, self.buffer[self.position:self.position+20]))
+    self.position += 1
+    return c
+
+  def value(self):
+    "Decode the next JSON value, reading more input until it is whole."
+    self.peek()
+    while True:
+      try:
+        value, end = self.decoder.raw_decode(self.buffer, self.position)
+      except ValueError:
+        if not self.read_more():
+          raise
+        continue
+      # a number at the end of the buffer may continue in the next chunk
+      if end == len(self.buffer) and self.read_more():
+        continue
+      self.position = end
+      return value
+
+  def object_keys(self):
+    """
+    Generate the keys of the object being read. The caller must read
+    each key's value before asking for the next key.
+    """
+    self.expect('{')
+    if self.peek() == '}':
+      self.position += 1
+      return
+    while True:
+      key = self.value()
+      self.expect(':')
+      yield key
+      if self.expect(',}') == '}':
+        return
+
+  def read(self):
+    for key in self.object_keys():
+      if key == 'items':
+        for doc_id in self.object_keys():
+          yield doc_id, self.value()
+      else:
+        self.metadata[key] = self.value()
+    # any further objects are NDJSON lines, each with one document
+    while self.peek() == '{':
+      for doc_id, segmentations in self.value().items():
+        yield doc_id, segmentations
+    if self.peek():
+      raise ValueError('unexpected data after segmentations: {!r}'.format(
+          self.buffer[self.position:self.position+20]))
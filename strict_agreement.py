@@ -1,21 +1,21 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import numpy
 import operator
 from argparse import ArgumentParser
-from collections import Counter
 from itertools import combinations
 from functools import partial
 from termcolor import colored
 from utils import *
 
-def count_judgments(index_lists):
+def count_judgments(index_lists, m):
   """
-  Given a list of boundary index lists (one per coder), return a dict
-  with the boundary indexes as keys and the number of times each index
-  appeared in a list as the vals.
+  Given a list of boundary index lists (one per coder) and a total
+  mass `m`, return an array with the number of times each potential
+  boundary index (1 to ``m-1``) appeared in a list.
   """
-  return reduce(lambda x,y: x+y, [ Counter(l) for l in index_lists ])
+  return boundary_counts(index_lists, m)
 
 def pairwise_agreement(c, n):
   """
@@ -28,17 +28,18 @@ def pairwise_agreement(c, n):
   """
   return (n*(n-1) + (c-n)*(c-n-1)) / float(c*(c-1))
 
-def observed_agreement(c, m, judgments):
+def observed_agreement(c, judgments):
   """
-  Given a count `c` of coders, a total mass `m`, and counts of
-  positive boundary judgments for a list of indexes, calculate the
-  observed agreement.
+  Given a count `c` of coders and an array of counts of positive
+  boundary judgments for each potential boundary, calculate the
+  observed agreement: the mean of the pairwise agreements on each
+  potential boundary.
 
   This is based on the formula given in Artstein & Poesio 2008. 
   """
-  boundary_agreements = [ pairwise_agreement(c, judgments[i]) 
-                          for i in range(1, m) ]
-  return sum(boundary_agreements) / len(boundary_agreements)
+  n = judgments
+  agreeing_pairs = (n*(n-1) + (c-n)*(c-n-1)).sum()
+  return agreeing_pairs / float(c*(c-1)*len(judgments))
 
 def expected_agreement(c, i, n, power=2):
   """
@@ -68,21 +69,150 @@ def variance_pi(c, i):
   """
   return 2 / float(i*c*(c-1))
 
+def judgments_multi_pi(c, judgments):
+  """
+  Given a count `c` of coders and an array of counts of positive
+  boundary judgments for each potential boundary, calculate Fleiss’s
+  multi-π, and return the coefficient and its variance.
+  """
+  return MultiPiAccumulator.from_judgments(c, judgments).coefficient()
+
+class MultiPiAccumulator(object):
+  """
+  The statistics multi-π is calculated from, for a sequence of
+  documents: the count `c` of coders, the count `i` of potential
+  boundaries, the total number of agreeing judgment pairs, and the
+  count `n` of positive boundary judgments. Merging the accumulators
+  of consecutive documents gives the statistics of the concatenated
+  segmentations (see `utils.overall_segmentations`), which have one
+  more potential boundary at the join, where every coder agrees.
+  """
+  def __init__(self, c, i, agreeing_pairs, n):
+    self.c = c
+    self.i = i
+    self.agreeing_pairs = agreeing_pairs
+    self.n = n
+
+  @classmethod
+  def from_judgments(cls, c, judgments):
+    n = judgments
+    return cls(c, len(judgments), 
+               (n*(n-1) + (c-n)*(c-n-1)).sum(), int(judgments.sum()))
+
+  def merge(self, other):
+    "Return the accumulator of this sequence followed by `other`."
+    assert self.c == other.c
+    c = self.c
+    return MultiPiAccumulator(
+      c, self.i + other.i + 1, 
+      self.agreeing_pairs + other.agreeing_pairs + c*(c-1),
+      self.n + other.n + c)
+
+  def coefficient(self):
+    "Return multi-π and its variance."
+    c, i = self.c, self.i
+    o = self.agreeing_pairs / float(c*(c-1)*i)
+    e = expected_agreement(c, i, self.n)
+    agreement = (o-e) / (1-e)
+    var = variance_pi(c, i)
+    return (agreement, var)
+
 def multi_pi(segmentations):
   """
   Given coders' segmentations (represented as segment masses),
   calculate strict agreement on boundaries using Fleiss’s multi-π, and
   return the coefficient and its variance.
   """
+  return accumulate_multi_pi(segmentations)[0]
+
+def accumulate_multi_pi(segmentations):
+  """
+  Like `multi_pi`, but also return the `MultiPiAccumulator` the
+  coefficient was calculated from.
+  """
   index_lists, m = masses_to_indexes(segmentations)
-  judgments = count_judgments(index_lists)
-  c = len(segmentations)
-  o = observed_agreement(c, m, judgments)
-  n = sum(judgments.values())
-  e = expected_agreement(c, m-1, n)
-  agreement = (o-e) / (1-e)
-  var = variance_pi(c, m-1)
-  return (agreement, var)
+  accumulator = MultiPiAccumulator.from_judgments(
+    len(segmentations), count_judgments(index_lists, m))
+  return accumulator.coefficient(), accumulator
+
+# permutations drawn in each task of a permutation test, and the most
+# random numbers drawn at a time
+PERMUTATION_CHUNK = 1000
+BLOCK = 1 << 20
+
+def permuted_accumulator(seed, task):
+  """
+  Given a task of a document's index, the index of a chunk of
+  permutations, the count `c` of human coders, the counts of positive
+  judgments of the humans and the evaluated coder together, and a
+  number of permutations, return a `MultiPiAccumulator` of arrays
+  holding the statistics of the human coders in each permutation.
+
+  In a permutation, the evaluated coder's judgment on each potential
+  boundary is swapped with that of a randomly chosen coder (possibly
+  itself), so it is positive with probability ``judgments/(c+1)``. As
+  the counts of all the judgments do not change, the humans' counts
+  are those counts less the evaluated coder's new judgments.
+  """
+  index, chunk, c, judgments, permutations = task
+  rng = numpy.random.RandomState([seed, index, chunk])
+  agreeing_pairs = lambda n: n*(n-1) + (c-n)*(c-n-1)
+  # the agreeing pairs the humans lose where they lose a positive
+  loss = agreeing_pairs(judgments) - agreeing_pairs(judgments-1)
+  p_positive = judgments / float(c+1)
+  pairs = numpy.empty(permutations)
+  n = numpy.empty(permutations, dtype=int)
+  rows = max(1, BLOCK // max(1, len(judgments)))
+  for start in range(0, permutations, rows):
+    positive = rng.random_sample(
+      (min(rows, permutations-start), len(judgments))) < p_positive
+    pairs[start:start+rows] = (agreeing_pairs(judgments).sum() - 
+                               positive.dot(loss.astype(float)))
+    n[start:start+rows] = judgments.sum() - positive.sum(axis=1)
+  return MultiPiAccumulator(c, len(judgments), pairs, n)
+
+def permutation_test(items, evaluated, permutations, seed=0, jobs=1):
+  """
+  Given the human coders' segmentations and those of a single coder
+  being evaluated (dicts of document IDs and ``{coder:segmentation}``
+  dicts), test whether adding the evaluated coder changes multi-π more
+  than adding a human would, by randomly swapping its judgments with
+  the humans' (see `permuted_accumulator`). Return a dict of the
+  documents' two-sided p-values and the p-value of the concatenated
+  documents. Permutations are drawn in chunks spread over `jobs` worker
+  processes; each chunk has its own random stream, determined by
+  `seed`, so results do not depend on the number of jobs.
+  """
+  doc_ids, segmentations = document_segmentations(items)
+  coders = [ evaluated[d].values() for d in doc_ids ]
+  assert all(len(s) == 1 for s in coders), 'evaluate a single coder'
+  every = [ masses_to_indexes(s + e) for s,e in zip(segmentations, coders) ]
+  judgments = [ count_judgments(index_lists, m) for index_lists,m in every ]
+  c = len(segmentations[0])
+  tasks = [ (index, chunk, c, judgments[index], 
+             min(PERMUTATION_CHUNK, permutations - chunk*PERMUTATION_CHUNK))
+            for index in range(len(doc_ids))
+            for chunk in range(-(-permutations // PERMUTATION_CHUNK)) ]
+  permuted = balanced_map(
+    partial(permuted_accumulator, seed), tasks, 
+    [ len(j)*count for index,chunk,c,j,count in tasks ], jobs)
+  per_document = []
+  for index, s in enumerate(segmentations):
+    chunks = [ a for t,a in zip(tasks, permuted) if t[0] == index ]
+    pairs = numpy.concatenate([ a.agreeing_pairs for a in chunks ])
+    n = numpy.concatenate([ a.n for a in chunks ])
+    per_document.append((
+      MultiPiAccumulator.from_judgments(c+1, judgments[index]),
+      accumulate_multi_pi(s)[1],
+      MultiPiAccumulator(c, len(judgments[index]), pairs, n)))
+  def p_value((every, humans, permuted)):
+    observed = abs(every.coefficient()[0] - humans.coefficient()[0])
+    differences = abs(every.coefficient()[0] - permuted.coefficient()[0])
+    # allow for rounding when a permutation gives the observed counts
+    extreme = (differences >= observed - 1e-12).sum()
+    return (extreme + 1) / float(permutations + 1)
+  return ({ d:p_value(a) for d,a in zip(doc_ids, per_document) },
+          p_value([ merge_accumulators(list(a)) for a in zip(*per_document) ]))
 
 def show_results(title, per_document, overall):
   print '\n{}:\n'.format(title)
@@ -109,6 +239,14 @@ def parse_args():
   p.add_argument(
     '-e', '--evaluate', help='name of a segmentation file to evaluate',
     metavar='filename')
+  p.add_argument(
+    '-p', '--permutations', metavar='N', type=int, default=0,
+    help='with --evaluate, also test significance with N permutations')
+  p.add_argument(
+    '--seed', type=int, default=0, help='random seed for permutations')
+  p.add_argument(
+    '-j', '--jobs', metavar='J', type=int, default=1, 
+    help='number of worker processes to use')
   return p.parse_args()
 
 def compare(values1, values2):
@@ -120,27 +258,32 @@ def compare(values1, values2):
   c2, v2 = values2
   return (c1-c2), ((c1-c2)/((v1+v2))**.5)
 
-def format_comparison(d, val, comp):
+def format_comparison(d, val, comp, p=None):
   c,v = val
   drop,z = comp
-  formatted = '{}: {} ({:.2f}, z: {:.2f})'.format(
-    d.split(':')[-1], format_coefficient(c,v), drop, z)
+  formatted = '{}: {} ({:.2f}, z: {:.2f}{})'.format(
+    d.split(':')[-1], format_coefficient(c,v), drop, z,
+    '' if p is None else ', p: {:.3f}'.format(p))
   if z > 1.96 or z < -1.96:
     return colored(formatted, 'red')
   else:
     return formatted
 
-def do(title, items, func, ref=None):
-  per_document, overall = get_results(items, func)
+def do(title, items, ref=None, jobs=1, p_values=None):
+  per_document, overall = accumulated_results(
+    items, accumulate_multi_pi, MultiPiAccumulator.coefficient, jobs)
   if ref:
     ref_per_document, ref_overall = ref
+    p_per_document, p_overall = p_values or ({}, None)
     values = sorted([ (doc_id, v, compare(v,ref_per_document[doc_id])) 
                        for doc_id,v in per_document.items() ],
                     key=lambda x: x[2][0], reverse=True)
     print '\n{}:\n'.format(title)
     print '\n'.join(
-      [ format_comparison(d, val, comp) for d,val,comp in values ])
-    print format_comparison('\nOverall', overall, compare(overall, ref_overall))
+      [ format_comparison(d, val, comp, p_per_document.get(d)) 
+        for d,val,comp in values ])
+    print format_comparison('\nOverall', overall, 
+                            compare(overall, ref_overall), p_overall)
     print
   else:
     show_results(title, per_document, overall)
@@ -154,10 +297,14 @@ def main():
   print '''
 Strict segmentation agreement, where agreement is modeled as two
 annotators making the same judgment on a potential boundary.'''
-  ref = do('Fleiss’s multi-π, human coders', items, multi_pi) 
+  ref = do('Fleiss’s multi-π, human coders', items, jobs=args.jobs) 
   if args.evaluate:
     e = load_segmentation_data(args.evaluate)
-    do('With {}'.format(e['id']), merge(items, e['items']), multi_pi, ref)
+    p_values = permutation_test(
+      items, e['items'], args.permutations, args.seed, args.jobs
+    ) if args.permutations else None
+    do('With {}'.format(e['id']), merge(items, e['items']), ref, args.jobs,
+       p_values)
     
 if __name__ == "__main__":
   main()
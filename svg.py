@@ -67,10 +67,80 @@ LABEL = '''
     <text x="3" y="2" style="font-size:6px;font-family:sans-serif">{text}</text>
   </g>
 '''
+def label_width(text):
+  return 4*len(str(text))+4
+
 def label(strip_index, y, text):
   return LABEL.format(
     x=strip_index*STRIP_WIDTH,
     y=y,
     text=str(text),
-    width=4*len(str(text))+4)
+    width=label_width(text))
+
+
+# Compact output: styles are defined once as CSS classes, each strip's
+# boundaries are drawn as a single path, and the label boxes are
+# reused through symbols, one for each width.
+
+COMPACT_HEAD = '''<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1" width="{width}" height="{height}" id="svg2">
+  <style>
+    path {{ fill:none;stroke:#000000;stroke-width:1;stroke-linecap:square }}
+    .boundary {{ stroke-dasharray:3, 3 }}
+    .tick {{ stroke-width:0.5 }}
+    .highlight {{ stroke:#00ff00;stroke-width:{tick_width};stroke-linecap:butt }}
+    .label {{ fill:#ffffff;stroke:#000000;stroke-width:0.3 }}
+    text {{ font-size:6px;font-family:sans-serif }}
+  </style>
+  <defs>{symbols}
+  </defs>
+  <g id="layer1" transform="translate({translate_x},0)">
+'''
+SYMBOL = '''
+    <symbol id="label-{width}" overflow="visible">
+      <rect class="label" width="{width}" height="8" rx="5" ry="5" x="0" y="-4" />
+    </symbol>'''
+def compact_header(strips, height, labels):
+  "`labels` are all the label texts that will be used."
+  widths = sorted(set(label_width(text) for text in labels))
+  return COMPACT_HEAD.format(
+    width=strips*STRIP_WIDTH+5, height=height, translate_x=TICK_WIDTH,
+    tick_width=TICK_WIDTH,
+    symbols=''.join(SYMBOL.format(width=w) for w in widths))
+
+COMPACT_PATH = '''
+    <path class="{cls}" d="{d}"{extra} />
+'''
+def lines(strip_index, ys, length=1, 
+          color=None, opacity=None, dashed=False):
+  "Like `line`, but drawing a line at each of `ys` as one path."
+  style = ''.join([ 'stroke:{};'.format(color) if color else '',
+                    'stroke-opacity:{};'.format(opacity) if opacity else '' ])
+  return COMPACT_PATH.format(
+    cls='boundary' if dashed else 'line',
+    d=' '.join('M{},{}h{}'.format(strip_index*STRIP_WIDTH, y, 
+                                  length*STRIP_WIDTH) for y in ys),
+    extra=' style="{}"'.format(style) if style else '')
+
+def ticks(ys):
+  "Like `tick`, but drawing a tick at each of `ys` as one path."
+  return COMPACT_PATH.format(
+    cls='tick', 
+    d=' '.join('M{},{}h{}'.format(-TICK_WIDTH, y, TICK_WIDTH) for y in ys),
+    extra='')
+
+def highlights(spans):
+  "Like `highlight`, but drawing each ``(y, length)`` span as one path."
+  return COMPACT_PATH.format(
+    cls='highlight', 
+    d=' '.join('M{},{}v{}'.format(-TICK_WIDTH/2.0, y, length) 
+               for y, length in spans),
+    extra='')
 
+COMPACT_LABEL = '''
+    <use xlink:href="#label-{width}" x="{x}" y="{y}" /><text x="{text_x}" y="{text_y}">{text}</text>'''
+def compact_label(strip_index, y, text):
+  "Like `label`, but using the label symbol for the text's width."
+  x = strip_index*STRIP_WIDTH
+  return COMPACT_LABEL.format(
+    width=label_width(text), x=x, y=y, text_x=x+3, text_y=y+2, text=str(text))
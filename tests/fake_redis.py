@@ -0,0 +1,75 @@
+import fnmatch
+import threading
+
+class FakeRedis(object):
+  """
+  An in-process stand-in for a Redis client (with responses decoded),
+  holding lists, hashes, sets and strings in a dict. It supports the
+  commands the export tools use, and pipelines, which count the round
+  trips they would make in `executed`.
+  """
+  def __init__(self, data=None):
+    self.data = dict(data or {})
+    self.executed = 0
+    self.lock = threading.Lock()
+
+  def type(self, key):
+    value = self.data.get(key)
+    if value is None:
+      return 'none'
+    for t, kind in [ ('list', list), ('hash', dict), ('set', set) ]:
+      if isinstance(value, kind):
+        return t
+    return 'string'
+
+  def scan_iter(self, match='*'):
+    return iter([ k for k in sorted(self.data) 
+                  if fnmatch.fnmatchcase(k, match) ])
+
+  def get(self, key):
+    return self.data.get(key)
+
+  def lrange(self, key, start, end):
+    values = self.data.get(key, [])
+    return values[start:(None if end == -1 else end+1)]
+
+  def llen(self, key):
+    return len(self.data.get(key, []))
+
+  def rpush(self, key, *values):
+    self.data.setdefault(key, []).extend(values)
+    return len(self.data[key])
+
+  def hget(self, key, field):
+    return self.data.get(key, {}).get(field)
+
+  def hgetall(self, key):
+    return dict(self.data.get(key, {}))
+
+  def hmset(self, key, mapping):
+    self.data.setdefault(key, {}).update(mapping)
+    return True
+
+  def smembers(self, key):
+    return set(self.data.get(key, set()))
+
+  def delete(self, *keys):
+    return len([ self.data.pop(k) for k in keys if k in self.data ])
+
+  def pipeline(self, transaction=True):
+    return FakePipeline(self)
+
+class FakePipeline(object):
+  "Queue commands on a `FakeRedis`, to run when `execute` is called."
+  def __init__(self, r):
+    self.r = r
+    self.commands = []
+  def __getattr__(self, command):
+    method = getattr(self.r, command)
+    return lambda *args: self.commands.append((method, args))
+  def execute(self):
+    with self.r.lock:
+      self.r.executed += 1
+      results = [ method(*args) for method, args in self.commands ]
+    self.commands = []
+    return results
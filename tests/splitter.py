@@ -0,0 +1,21 @@
+#! /usr/bin/env python
+
+"""
+A stand-in for the sentence splitter, for testing: reads paragraphs
+(separated by blank lines) on stdin and writes one sentence per line,
+ending a sentence after ., ! or ? and at the end of a paragraph.
+"""
+
+import re
+import sys
+
+def main():
+  text = sys.stdin.read().decode('utf-8')
+  for paragraph in re.split(r'\n\s*\n', text):
+    for sentence in re.split(r'(?<=[.!?])\s+', paragraph.strip()):
+      if sentence:
+        print re.sub(r'\s+', ' ', sentence).encode('utf-8')
+    print
+
+if __name__ == "__main__":
+  main()
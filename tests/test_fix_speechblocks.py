@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import unittest
+import fix_speechblocks
+
+SPLITTER = [ sys.executable, 
+             os.path.join(os.path.dirname(__file__), 'splitter.py') ]
+
+TEXTS = [
+  u'One sentence. And another one!',
+  u'',
+  u'No final punctuation',
+  u'A delimiter: {} in a sentence. Then more.'.format(
+    fix_speechblocks.DELIMITER),
+  u'{0}X and {0}'.format(fix_speechblocks.DELIMITER),
+  u'',
+  u'Non-ASCII text — “quoted.” Yes?' ]
+
+class SplitBatchTest(unittest.TestCase):
+  def setUp(self):
+    self.splitter = fix_speechblocks.SPLITTER
+    fix_speechblocks.SPLITTER = SPLITTER
+
+  def tearDown(self):
+    fix_speechblocks.SPLITTER = self.splitter
+
+  def test_batch_matches_single_texts(self):
+    expected = [ fix_speechblocks.split_batch([t])[0] for t in TEXTS ]
+    self.assertEqual(fix_speechblocks.split_batch(TEXTS), expected)
+
+  def test_sentences(self):
+    self.assertEqual(fix_speechblocks.split_batch(TEXTS[:3]), [
+        [ u'One sentence.', u'And another one!' ], 
+        [], 
+        [ u'No final punctuation' ] ])
+
+if __name__ == "__main__":
+  unittest.main()
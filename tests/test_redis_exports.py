@@ -0,0 +1,94 @@
+import unittest
+from functools import partial
+from redisutils import pipelined, map_interviews
+from speakers import speaker_masses
+from speechblocks import speechblock_masses
+from tests.fake_redis import FakeRedis
+from utils import indexes_to_masses, pairwise
+
+def interview_data(interview, speakers):
+  """
+  Given an interview ID and a list of speechblocks, each a list of the
+  speakers of its sentences, return the interview's keys and values.
+  """
+  data = { 'interviews:{}:sentences'.format(interview): [],
+           'interviews:{}:speechblocks'.format(interview): [] }
+  n = 0
+  for b, block in enumerate(speakers, start=1):
+    speechblock = 'speechblocks:{}/{}'.format(interview, b)
+    data['interviews:{}:speechblocks'.format(interview)].append(speechblock)
+    data['{}:sentences'.format(speechblock)] = []
+    for speaker in block:
+      n += 1
+      sentence = 'sentences:{}/{}'.format(interview, n)
+      data[sentence] = { 'speaker':speaker, 'speechblock':speechblock }
+      data['interviews:{}:sentences'.format(interview)].append(sentence)
+      data['{}:sentences'.format(speechblock)].append(sentence)
+  return data
+
+SPEAKERS = {
+  'U-0001': [ ['a', 'a'], ['b'], ['a', 'a', 'a'], ['b', 'b'] ],
+  'U-0002': [ ['c'], ['d', 'd', 'd'], ['c'], ['d'] ],
+  'U-0003': [ ['e', 'e', 'e', 'e'] ] }
+
+# the exports as they were before pipelining, reading a key at a time
+
+def unpipelined_speaker_masses(r, interview):
+  speakers = [ r.hget(s, 'speaker') for s in r.lrange(
+      'interviews:{}:sentences'.format(interview), 0, -1) ]
+  interviewee = sorted((speakers.count(s),s) for s in set(speakers))[-1][1]
+  def compare(pair):
+    if interviewee in pair[1] and not pair[1][0] == pair[1][1]:
+      return pair[0]
+    return None
+  indexes = [ i for i in 
+              map(compare, enumerate(pairwise(speakers), start=1)) 
+              if i is not None ]
+  [masses] = indexes_to_masses([indexes], len(speakers))
+  return masses
+
+def unpipelined_speechblock_masses(r, interview):
+  speechblocks = 'interviews:{}:speechblocks'.format(interview)
+  return [ r.llen('{}:sentences'.format(k)) 
+           for k in r.lrange(speechblocks, 0, -1) ]
+
+class RedisExportsTest(unittest.TestCase):
+  def setUp(self):
+    data = {}
+    for interview, speakers in SPEAKERS.items():
+      data.update(interview_data(interview, speakers))
+    self.r = FakeRedis(data)
+
+  def test_pipelined(self):
+    keys = sorted(k for k in self.r.data if self.r.type(k) == 'list')
+    expected = [ self.r.llen(k) for k in keys ]
+    self.assertEqual(pipelined(self.r, 'llen', [ (k,) for k in keys ], 3), 
+                     expected)
+    self.assertEqual(self.r.executed, -(-len(keys) // 3))
+    self.assertEqual(pipelined(self.r, 'llen', []), [])
+
+  def test_map_interviews(self):
+    interviews = sorted(SPEAKERS) * 3
+    for jobs in [1, 4]:
+      self.assertEqual(map_interviews(len, interviews, jobs), 
+                       map(len, interviews))
+
+  def compare_exports(self, f, unpipelined, expected):
+    interviews = sorted(SPEAKERS)
+    for jobs in [1, 4]:
+      self.assertEqual(map_interviews(partial(f, self.r), interviews, jobs),
+                       expected)
+    self.assertEqual(map(partial(unpipelined, self.r), interviews), expected)
+
+  def test_speechblock_masses(self):
+    self.compare_exports(
+      speechblock_masses, unpipelined_speechblock_masses,
+      [ map(len, SPEAKERS[i]) for i in sorted(SPEAKERS) ])
+
+  def test_speaker_masses(self):
+    self.compare_exports(
+      speaker_masses, unpipelined_speaker_masses,
+      [ [2, 1, 3, 2], [1, 3, 1, 1], [4] ])
+
+if __name__ == "__main__":
+  unittest.main()
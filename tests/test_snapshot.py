@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+from snapshot import Snapshot, export
+from speakers import speaker_masses
+from speechblocks import speechblock_masses
+from tests.fake_redis import FakeRedis
+from tests.test_redis_exports import SPEAKERS, interview_data
+
+class SnapshotTest(unittest.TestCase):
+  def setUp(self):
+    data = {}
+    for interview, speakers in SPEAKERS.items():
+      data.update(interview_data(interview, speakers))
+    # sentence keys need not be named for their interview
+    renamed = { k:'sentence-{}'.format(i) for i,k in enumerate(sorted(
+          k for k in data if k.startswith('sentences:'))) }
+    self.r = FakeRedis(
+      (renamed.get(k, k), [ renamed.get(x, x) for x in v ] 
+       if isinstance(v, list) else v) for k,v in data.items())
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'snapshot')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_exports_match(self):
+    interviews = sorted(SPEAKERS)
+    export(self.r, interviews, self.filename, jobs=2)
+    snapshot = Snapshot(self.filename)
+    self.assertEqual(snapshot.interviews(), interviews)
+    for f in [ speaker_masses, speechblock_masses ]:
+      self.assertEqual([ f(snapshot, i) for i in interviews ],
+                       [ f(self.r, i) for i in interviews ])
+    self.assertEqual(snapshot.hgetall('sentence-0'), 
+                     self.r.hgetall('sentence-0'))
+    self.assertEqual(snapshot.hgetall('missing'), {})
+
+  def test_unknown_type(self):
+    class WithSortedSet(FakeRedis):
+      def type(self, key):
+        if key == 'interviews:U-0001:ranks':
+          return 'zset'
+        return FakeRedis.type(self, key)
+    r = WithSortedSet(self.r.data)
+    r.data['interviews:U-0001:ranks'] = 'a zset'
+    with self.assertRaises(ValueError):
+      export(r, ['U-0001'], self.filename)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import columnar
+import heapq
 import json
+import numpy
 import operator
+import sys
+from functools import partial
 from itertools import chain, groupby, tee, izip
+from multiprocessing import Pool, current_process
+from streaming import SegmentationReader
 
 def pairwise(iterable):
   "s -> (s0,s1), (s1,s2), (s2, s3), ..."
@@ -33,6 +40,27 @@ def masses_to_indexes(mass_lists):
   assert 1 == len(set(total_masses)) # make sure they all add up the same
   return index_lists, total_masses[0]
 
+def boundary_counts(index_lists, m):
+  """
+  Given boundary index lists (one per coder) and a total mass `m`,
+  return an array with the number of coders who placed a boundary at
+  each potential boundary index from 1 to ``m-1``.
+  """
+  # the leading 0 keeps bincount happy when no boundaries were placed
+  indexes = numpy.array([0] + list(chain(*index_lists)), dtype=int)
+  return numpy.bincount(indexes, minlength=m)[1:m]
+
+def boundary_matrix(index_lists, m):
+  """
+  Given boundary index lists (one per coder) and a total mass `m`,
+  return a coders × potential boundaries indicator matrix, in which
+  column ``i-1`` holds the coders' judgments on boundary index ``i``.
+  """
+  matrix = numpy.zeros((len(index_lists), m-1), dtype=int)
+  for row, indexes in zip(matrix, index_lists):
+    row[numpy.array(indexes, dtype=int) - 1] = 1
+  return matrix
+
 def zip_differences(l):
   return [ operator.sub(*pair) for pair in zip(l[1:], l[0:]) ]
 
@@ -52,16 +80,81 @@ def assert_same_coders(documents):
   coders = [ set(segmentations.keys()) for segmentations in documents.values() ]
   assert set.intersection(*coders) == set.union(*coders)
 
-def per_document_coefficients(documents, f):
+def document_segmentations(documents):
   """
   Expects a dict with document IDs as keys and ``{coder:segmentation}`` 
   dicts as values. Note that each document must have the same set of 
-  coders, or an exception will be thrown.
+  coders, or an exception will be thrown. Returns the sorted document
+  IDs and a list of each document's segmentations, ordered by coder.
   """
   assert_same_coders(documents)
+  doc_ids = sorted(documents)
   # make sure the segmentations are always in the same order
-  return { doc_id: f([ segs[a] for a in sorted(segs) ] )
-           for doc_id, segs in documents.items() }
+  return doc_ids, [ [ documents[d][a] for a in sorted(documents[d]) ]
+                    for d in doc_ids ]
+
+def per_document_coefficients(documents, f, jobs=1):
+  """
+  Expects a dict with document IDs as keys and ``{coder:segmentation}`` 
+  dicts as values. Note that each document must have the same set of 
+  coders, or an exception will be thrown. With `jobs` > 1, documents
+  are divided among that many worker processes.
+  """
+  doc_ids, segmentations = document_segmentations(documents)
+  return dict(zip(doc_ids, balanced_map(
+        f, segmentations, map(task_size, segmentations), jobs)))
+
+def parallel_map(f, iterable, jobs=1):
+  """
+  Map `f` over `iterable` in a pool of `jobs` worker processes and
+  return the results in order. Runs serially if `jobs` is 1 or if we
+  are already inside a worker process (pools cannot be nested).
+  """
+  if jobs == 1 or current_process().daemon:
+    return map(f, iterable)
+  pool = Pool(jobs)
+  try:
+    return pool.map(f, iterable)
+  finally:
+    pool.terminate()
+
+def task_size(segmentations):
+  "Estimate the cost of a metric on segmentations: mass times coders."
+  return sum(segmentations[0]) * len(segmentations)
+
+def balanced_chunks(sizes, count):
+  """
+  Divide the indexes of tasks with the given `sizes` into at most
+  `count` chunks of roughly equal total size, by giving each task,
+  largest first, to the chunk with the smallest total so far.
+  """
+  heap = [ (0, i, []) for i in range(count) ]
+  for t in sorted(range(len(sizes)), key=lambda t: sizes[t], reverse=True):
+    total, i, chunk = heapq.heappop(heap)
+    chunk.append(t)
+    heapq.heappush(heap, (total + sizes[t], i, chunk))
+  return [ chunk for total, i, chunk in sorted(heap, key=lambda x: x[1]) 
+           if chunk ]
+
+def map_chunk(f, tasks):
+  return [ f(t) for t in tasks ]
+
+def balanced_map(f, tasks, sizes, jobs=1):
+  """
+  Like `parallel_map`, but send the `tasks` to the worker processes in
+  chunks of roughly equal total size (see `balanced_chunks`), so that
+  a few very large tasks do not keep the other workers idle. Results
+  are returned in the order of `tasks`.
+  """
+  if jobs == 1 or current_process().daemon:
+    return map(f, tasks)
+  chunks = balanced_chunks(sizes, jobs)
+  results = [None] * len(tasks)
+  for chunk, chunk_results in zip(chunks, parallel_map(
+      partial(map_chunk, f), [ [ tasks[t] for t in c ] for c in chunks ], jobs)):
+    for t, result in zip(chunk, chunk_results):
+      results[t] = result
+  return results
 
 def flattened(dicts):
   "Flatten a sequence of dictionaries into a single sequence of tuples."
@@ -83,13 +176,109 @@ def overall_segmentations(documents):
 def overall_coefficient(documents, f):
   return f(overall_segmentations(documents))
 
-def get_results(documents, f):
-  return (per_document_coefficients(documents, f), 
-          overall_coefficient(documents, f))
+def get_results(documents, f, jobs=1):
+  """
+  Return the per-document coefficients and the overall coefficient.
+  With `jobs` > 1, the overall coefficient is computed by one of the
+  worker processes alongside the per-document ones.
+  """
+  doc_ids, segmentations = document_segmentations(documents)
+  tasks = segmentations + [ overall_segmentations(documents) ]
+  results = balanced_map(f, tasks, map(task_size, tasks), jobs)
+  return dict(zip(doc_ids, results[:-1])), results[-1]
+
+def merge_accumulators(accumulators):
+  """
+  Merge a list of accumulators (objects with a `merge` method returning
+  the accumulator of themselves followed by another) in order,
+  merging neighbours pairwise so that merges are of similar sizes.
+  """
+  while len(accumulators) > 1:
+    merged = [ a.merge(b) for a,b in zip(accumulators[::2], 
+                                          accumulators[1::2]) ]
+    accumulators = merged + accumulators[len(merged)*2:]
+  return accumulators[0]
+
+def accumulated_results(documents, f, coefficient, jobs=1):
+  """
+  Return the per-document coefficients and the overall coefficient,
+  given a function `f` returning the coefficient of a document's
+  segmentations along with an accumulator of the statistics it was
+  calculated from, and a function `coefficient` calculating the
+  coefficient of an accumulator. The overall coefficient is that of
+  the documents' accumulators merged in document order, which equals
+  `overall_coefficient` without concatenating the segmentations.
+  """
+  doc_ids, segmentations = document_segmentations(documents)
+  results = balanced_map(f, segmentations, map(task_size, segmentations), 
+                         jobs)
+  per_document = { d:value for d,(value,accumulator) in zip(doc_ids, results) }
+  return per_document, coefficient(merge_accumulators(
+      [ accumulator for value,accumulator in results ]))
+
+def open_segmentation_data(filename):
+  "Open a segmentation file, or standard input if `filename` is '-'."
+  return sys.stdin if filename == '-' else open(filename)
+
+def read_segmentation_data(filename):
+  """
+  Read segmentation data incrementally, returning an iterable of
+  ``(doc_id, {coder:segmentation})`` pairs whose `metadata` dict holds
+  the other top-level fields (such as 'id'). JSON and NDJSON files are
+  parsed one document at a time (see `streaming`); columnar files are
+  memory-mapped.
+  """
+  if filename != '-' and columnar.is_columnar(filename):
+    return LoadedReader(columnar.load(filename))
+  return SegmentationReader(open_segmentation_data(filename))
+
+class LoadedReader(object):
+  "A reader over segmentation data that has already been loaded."
+  def __init__(self, o):
+    self.metadata = { k:v for k,v in o.items() if not k == 'items' }
+    self.items = o['items']
+  def field(self, key, *default):
+    if default:
+      return self.metadata.get(key, default[0])
+    return self.metadata[key]
+  def __iter__(self):
+    return self.items.iteritems()
 
 def load_segmentation_data(filename):
-  with open(filename) as data:
-    return json.load(data)  
+  """
+  Load segmentation data from a JSON, NDJSON or columnar binary file
+  (see `columnar`), or from standard input if `filename` is '-'.
+  Columnar files are memory-mapped rather than read.
+  """
+  if filename != '-' and columnar.is_columnar(filename):
+    return columnar.load(filename)
+  reader = read_segmentation_data(filename)
+  items = dict(reader)
+  return dict(reader.metadata, items=items)
+
+def write_segmentation_data(metadata, items, ndjson=False):
+  """
+  Print segmentation data with the given top-level `metadata` fields
+  and `items`, an iterable of ``(doc_id, {coder:segmentation})`` pairs.
+  With `ndjson`, print the metadata on one line and then each document
+  on its own line as soon as it is produced, instead of collecting
+  them into a single JSON object. `metadata` can also be a function
+  returning the fields, which is called after the items have been
+  collected if it can be (i.e. without `ndjson`), so that it can use
+  fields read after the items.
+  """
+  if ndjson:
+    if callable(metadata):
+      metadata = metadata()
+    print json.dumps(metadata, sort_keys=True)
+    for doc_id, segmentations in items:
+      print json.dumps({ doc_id:segmentations }, sort_keys=True)
+      sys.stdout.flush()
+  else:
+    items = dict(items)
+    if callable(metadata):
+      metadata = metadata()
+    print json.dumps(dict(metadata, items=items), sort_keys=True)
 
 def error(variance, interval=0.95):
   if interval == 0.95:
@@ -99,15 +288,32 @@ def error(variance, interval=0.95):
   raise Exception('interval must be .95 or .5')
 
 def format_coefficient(c, v):
+  if v is None:
+    return '{:.2f}'.format(c)
   return '{:.2f}±{:.2f}'.format(c, error(v)) 
 
 def print_coefficient(label, c, v):
-  print '{}: {:.2f}±{:.2f}'.format(label, c, error(v)) 
+  print '{}: {}'.format(label, format_coefficient(c, v))
 
 def print_coefficients(d):
   for doc, (c,v) in sorted(d.items(), key=lambda x: x[1], reverse=True):
     print_coefficient(doc.split(':')[1], c, v)
 
+def print_sweep(ks, per_document, overall):
+  """
+  Print a table of coefficients for each of the window sizes `ks`,
+  given lists of ``(coefficient, variance)`` pairs for each document
+  and for all of them.
+  """
+  def row(label, cells):
+    print '{:<12}'.format(label) + ''.join('{:>7}'.format(c) for c in cells)
+  row('k', ks)
+  print
+  for doc, values in sorted(per_document.items()):
+    row(doc.split(':')[-1], [ '{:.2f}'.format(c) for c,v in values ])
+  print
+  row('Overall', [ '{:.2f}'.format(c) for c,v in overall ])
+
 def filter_coders(documents, keep):
   [doc_ids, segmentations] = zip(*sorted(documents.items()))
   filtered = [ { k:v for k,v in s.items() if k in keep } 
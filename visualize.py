@@ -1,5 +1,7 @@
 #! /usr/bin/env python
 
+import hashlib
+import json
 import os
 import svg
 from argparse import ArgumentParser
@@ -17,41 +19,103 @@ def comparison_lines(compare, length, right_m):
     svg.line(0, key, index, length=length, color=color, opacity='0.75')
     for index in indexes ]
 
+# change this when the SVG output changes, so that existing files are
+# rewritten
+RENDERER_VERSION = 1
+
+def compact_comparison_lines(compare, length, right_m):
+  segmentations, color = compare
+  assert len(segmentations) == 1
+  [masses] = segmentations.values()
+  [indexes], m = masses_to_indexes([masses])
+  assert m == right_m
+  return svg.lines(0, indexes, length=length, color=color, opacity='0.75')
+
 def visualize(doc_id, segmentations, 
-              compare=[], tick_masses=None, highlight_masses=None):
-  "Given segmentations, return an SVG visualization"
+              compare=[], tick_masses=None, highlight_masses=None,
+              compact=False):
+  """
+  Given segmentations, generate the parts of an SVG visualization. If
+  `compact`, generate the smaller equivalent using shared styles,
+  symbols and one path per kind of line (see `svg.compact_header`).
+  """
   [coders, mass_lists] = zip(*sorted(segmentations.items()))
   index_lists, m = masses_to_indexes(mass_lists)
   if tick_masses:
     tick_indexes, tick_m = masses_to_indexes(tick_masses)
     assert tick_m == m
-    ticks = [ svg.tick(i) for i in tick_indexes[0] ]
-  else:
-    ticks = []
   if highlight_masses:
     highlight_indexes, highlight_m = masses_to_indexes(highlight_masses)
     assert highlight_m == m
+  if highlight_masses:
     offset = (0 if sum(highlight_masses[0][0::2]) > 
                    sum(highlight_masses[0][1::2]) else 1)
-    highlights = [ svg.highlight(y,l) 
-                   for y,l in zip([0] + highlight_indexes[0], 
-                                  highlight_masses[0])[offset::2] ]
+    spans = zip([0] + highlight_indexes[0], highlight_masses[0])[offset::2]
+  else:
+    spans = []
+  ticks = tick_indexes[0] if tick_masses else []
+  if compact:
+    yield svg.compact_header(len(segmentations), m+1, chain(*index_lists))
+    if spans:
+      yield svg.highlights(spans)
+    if ticks:
+      yield svg.ticks(ticks)
+    for coder_index, indexes in enumerate(index_lists):
+      if indexes:
+        yield svg.lines(coder_index, indexes, dashed=True)
+    for c in compare:
+      yield compact_comparison_lines(c, len(segmentations), m)
+    label = svg.compact_label
   else:
-    highlights = []
-  [lines,labels] = zip(*[ 
-      (svg.line(coder_index, coder, index, dashed=True),
-       svg.label(coder_index, index, index))
-      for coder_index, coder in enumerate(coders)
-      for index in index_lists[coder_index] ])
-  comparisons = list(chain(*[ 
-        comparison_lines(c, len(segmentations), m) for c in compare ]))
-  return (svg.header(len(segmentations), m+1)
-          + ''.join(highlights) + ''.join(ticks) + ''.join(lines) 
-          + ''.join(comparisons) + ''.join(labels) + svg.foot)
+    yield svg.header(len(segmentations), m+1)
+    for y,l in spans:
+      yield svg.highlight(y,l)
+    for i in ticks:
+      yield svg.tick(i)
+    for coder_index, coder in enumerate(coders):
+      for index in index_lists[coder_index]:
+        yield svg.line(coder_index, coder, index, dashed=True)
+    for c in compare:
+      for line in comparison_lines(c, len(segmentations), m):
+        yield line
+    label = svg.label
+  for coder_index, indexes in enumerate(index_lists):
+    for index in indexes:
+      yield label(coder_index, index, index)
+  yield svg.foot
 
-def write(filename, content):
+def write(filename, parts):
   with open(filename, 'w') as out:
-    out.write(content)
+    for part in parts:
+      out.write(part)
+
+def content_hash(task, compact=False):
+  "Hash a document's rendering inputs, along with the renderer version."
+  return hashlib.sha1(json.dumps([ RENDERER_VERSION, compact, task ], 
+                                 sort_keys=True)).hexdigest()
+
+def render(compact, task):
+  "Write the visualization of a (filename, doc_id, inputs) task."
+  filename, doc_id, (segmentations, compare, ticks, highlight) = task
+  write(filename, visualize(doc_id, segmentations, compare, ticks, highlight,
+                            compact))
+
+def manifest_filename(directory):
+  "The manifest of an output directory is kept next to it."
+  return os.path.normpath(directory) + '.manifest.json'
+
+def load_manifest(directory):
+  try:
+    with open(manifest_filename(directory)) as f:
+      return json.load(f)
+  except IOError:
+    return {}
+
+def save_manifest(directory, manifest):
+  filename = manifest_filename(directory)
+  with open(filename + '.tmp', 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+  os.rename(filename + '.tmp', filename)
 
 def main():
   "Produce SVG visualizations of segmentations."
@@ -70,6 +134,15 @@ def main():
   p.add_argument(
     '-o', '--output', help='directory to write SVG files to', 
     dest='dir', default='svg')
+  p.add_argument(
+    '-j', '--jobs', metavar='J', type=int, default=1, 
+    help='number of worker processes to use')
+  p.add_argument(
+    '-f', '--force', action='store_true',
+    help='rewrite every SVG file, even if its inputs are unchanged')
+  p.add_argument(
+    '--compact', action='store_true',
+    help='write smaller SVG files, with shared styles and merged paths')
   args = p.parse_args()
   o = load_segmentation_data(args.filename)
   if args.ticks:
@@ -88,13 +161,24 @@ def main():
     compare = []
   if not os.path.exists(args.dir):
     os.makedirs(args.dir)
-  [ write('{}/{}.svg'.format(args.dir, doc_id.split(':')[1]),
-          visualize(doc_id, 
-                    segmentations, 
-                    [ (d[doc_id], color) for d,color in compare ],
-                    ticks[doc_id].values() if doc_id in ticks else None,
-                    highlight[doc_id].values() if doc_id in highlight else None))
-    for doc_id, segmentations in o['items'].items() ]
+  manifest = {} if args.force else load_manifest(args.dir)
+  tasks, hashes = [], {}
+  for doc_id, segmentations in sorted(o['items'].items()):
+    name = '{}.svg'.format(doc_id.split(':')[1])
+    inputs = (
+      dict(segmentations),
+      [ (dict(d[doc_id]), color) for d,color in compare ],
+      ticks[doc_id].values() if doc_id in ticks else None,
+      highlight[doc_id].values() if doc_id in highlight else None)
+    hashes[name] = content_hash(inputs, args.compact)
+    filename = os.path.join(args.dir, name)
+    if manifest.get(name) != hashes[name] or not os.path.exists(filename):
+      tasks.append((filename, doc_id, inputs))
+  balanced_map(partial(render, args.compact), tasks, 
+               [ task_size(inputs[0].values()) for f,d,inputs in tasks ],
+               args.jobs)
+  manifest.update(hashes)
+  save_manifest(args.dir, manifest)
 
 if __name__ == "__main__":
   main()
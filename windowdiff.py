@@ -1,5 +1,9 @@
+# -*- coding: utf-8 -*-
+
+import numpy
 from collections import Counter
 from itertools import islice, tee, izip, chain
+from utils import boundary_matrix, masses_to_indexes
 
 def consume(iterator, n):
   "Advance the iterator `n` steps ahead."
@@ -19,17 +23,225 @@ def window_size(segmentations):
   "k is half the mean segment mass"
   return int(round(mean_segment_mass(segmentations) / 2))
 
+def window_labels(index_lists, m, k):
+  """
+  Given a list of boundary index lists (one per coder), a total mass
+  `m`, and a window size `k`, return a coders × windows array with the
+  label (number of boundaries) each coder placed in each window of
+  size `k`. The window sums are taken as differences of cumulative
+  boundary counts, so the cost does not depend on `k`.
+  """
+  return boundary_window_labels(boundary_matrix(index_lists, m), k)
+
+def boundary_window_labels(boundaries, k):
+  """
+  Like `window_labels`, but given a coders × potential boundaries
+  array of boundary judgments (see `utils.boundary_matrix`).
+  """
+  return cumulative_window_labels(cumulative_boundaries(boundaries), k)
+
+def cumulative_boundaries(boundaries):
+  """
+  Given a coders × potential boundaries array of boundary judgments,
+  return each coder's cumulative boundary counts, starting from 0.
+  """
+  c, n = boundaries.shape
+  cumulative = numpy.zeros((c, n+1), dtype=int)
+  cumulative[:,1:] = boundaries.cumsum(axis=1)
+  return cumulative
+
+def cumulative_window_labels(cumulative, k):
+  """
+  Like `window_labels`, but given `cumulative_boundaries`, which can
+  be reused for any window size.
+  """
+  n = cumulative.shape[1] - 1
+  return cumulative[:,k:] - cumulative[:,:max(n+1-k, 0)]
+
+def window_judgments(index_lists, m, k):
+  """
+  Given a list of boundary index lists (one per coder), a total mass
+  `m`, and a window size `k`, return a windows × labels array with the
+  count of coders who assigned each label (number of boundaries, from
+  0 to `k`) to each window of size `k`.
+  """
+  return label_judgments(window_labels(index_lists, m, k), k)
+
+def label_judgments(labels, k):
+  """
+  Given a coders × windows array of labels (see `window_labels`),
+  return the windows × labels array of label counts.
+  """
+  windows = labels.shape[1]
+  if windows == 0:
+    return numpy.zeros((0, k+1), dtype=int)
+  cells = (numpy.arange(windows)*(k+1) + labels).ravel()
+  return numpy.bincount(cells, minlength=windows*(k+1)).reshape(windows, k+1)
+
 def count_window_judgments(index_lists, m, k):
   """
   Given a list of boundary index lists (one per coder), a total mass
   `m`, and a window size `k`, return a list containing the label
   (number of boundaries) counts for each window of size `k`.
+
+  Kept for compatibility; prefer `window_judgments`, which returns the
+  same counts as an array.
   """
-  index_counts = [ Counter(l) for l in index_lists ]
-  windows = list(windowed(range(1,m), k))
-  labels_by_coder = [[ sum([ c[i] for i in w ]) for w in windows ]
-                     for c in index_counts ]
-  labels_by_window = zip(*labels_by_coder)
-  return [ Counter(labels) for labels in labels_by_window ]
+  return [ Counter(labels) 
+           for labels in window_labels(index_lists, m, k).T.tolist() ]
 
+def distinct_windows(judgments, counts=None):
+  """
+  Given a windows × labels array of label counts, return the distinct
+  rows of the array, in lexicographic order, and an array with the
+  number of windows having each one. If `counts` is given, it is the
+  number of windows having each row of `judgments`.
+  """
+  if counts is None:
+    counts = numpy.ones(len(judgments), dtype=int)
+  if len(judgments) == 0:
+    return judgments, numpy.zeros(0, dtype=int)
+  order = numpy.lexsort(judgments.T[::-1])
+  ordered = judgments[order]
+  changed = (ordered[1:] != ordered[:-1]).any(axis=1)
+  starts = numpy.flatnonzero(numpy.concatenate(([True], changed)))
+  return ordered[starts], numpy.add.reduceat(counts[order], starts)
 
+def combined_window_size(documents):
+  """
+  Given a list of each document's segmentations, return the
+  `window_size` of the documents' concatenated segmentations (see
+  `utils.overall_segmentations`) without concatenating them.
+  """
+  mass = sum( sum(s) for segmentations in documents for s in segmentations )
+  segments = sum( len(s) for segmentations in documents 
+                  for s in segmentations )
+  return int(round(mass / float(segments) / 2))
+
+def edges(boundaries, k):
+  "The first and last ``k-1`` columns of a boundary judgments array."
+  edge = max(k-1, 0)
+  n = boundaries.shape[1]
+  return boundaries[:,:edge], boundaries[:,max(n-edge, 0):]
+
+class WindowAccumulator(object):
+  """
+  The window judgments of a sequence of documents at window size `k`,
+  kept as `distinct_windows` rows and counts, along with the boundary
+  judgments on the first and last ``k-1`` potential boundaries (the
+  `head` and `tail`). Merging the accumulators of consecutive
+  documents gives the window judgments of the concatenated
+  segmentations (see `utils.overall_segmentations`): the edges are
+  needed to count the windows spanning the join, where every coder
+  has a boundary.
+  """
+  def __init__(self, k, judgments, counts, head, tail):
+    self.k = k
+    self.judgments = judgments
+    self.counts = counts
+    self.head = head
+    self.tail = tail
+
+  @property
+  def c(self):
+    return self.head.shape[0]
+
+  @classmethod
+  def from_boundaries(cls, boundaries, k, cumulative=None):
+    """
+    Given a coders × potential boundaries array of boundary judgments,
+    return the accumulator for windows of size `k`. The array's
+    `cumulative_boundaries` can be given if they are already known.
+    """
+    if cumulative is None:
+      cumulative = cumulative_boundaries(boundaries)
+    judgments, counts = distinct_windows(
+      label_judgments(cumulative_window_labels(cumulative, k), k))
+    return cls(k, judgments, counts, *edges(boundaries, k))
+
+  @classmethod
+  def from_indexes(cls, index_lists, m, k):
+    return cls.from_boundaries(boundary_matrix(index_lists, m), k)
+
+  def merge(self, other):
+    "Return the accumulator of this sequence followed by `other`."
+    assert (self.k, self.c) == (other.k, other.c)
+    join = numpy.ones((self.c, 1), dtype=int)
+    spanning = label_judgments(boundary_window_labels(
+        numpy.hstack([self.tail, join, other.head]), self.k), self.k)
+    judgments, counts = distinct_windows(
+      numpy.vstack([self.judgments, other.judgments, spanning]),
+      numpy.concatenate([self.counts, other.counts, 
+                         numpy.ones(len(spanning), dtype=int)]))
+    head, _ = edges(numpy.hstack([self.head, join, other.head]), self.k)
+    _, tail = edges(numpy.hstack([self.tail, join, other.tail]), self.k)
+    return WindowAccumulator(self.k, judgments, counts, head, tail)
+
+def document_windows(k, overall_k, segmentations):
+  """
+  Given coders' segmentations (represented as segment masses), return
+  a `WindowAccumulator` for the document's windows of size `k` (or of
+  its own `window_size` if `k` is None) and one for windows of size
+  `overall_k`, to be merged with other documents' (the same one if
+  the sizes are equal).
+  """
+  index_lists, m = masses_to_indexes(segmentations)
+  if k is None: k = window_size(segmentations)
+  boundaries = boundary_matrix(index_lists, m)
+  windows = WindowAccumulator.from_boundaries(boundaries, k)
+  if overall_k == k:
+    return windows, windows
+  return windows, WindowAccumulator.from_boundaries(boundaries, overall_k)
+
+def window_sizes(s):
+  "Parse a ``kmin:kmax`` range of window sizes, returning a list."
+  kmin, kmax = map(int, s.split(':'))
+  if not 1 <= kmin <= kmax:
+    raise ValueError('window sizes must be 1 <= kmin <= kmax')
+  return range(kmin, kmax+1)
+
+class SweepAccumulator(object):
+  """
+  The `WindowAccumulator`s of a sequence of documents for each of a
+  list of window sizes `ks`, merged size by size.
+  """
+  def __init__(self, ks, accumulators):
+    self.ks = ks
+    self.accumulators = accumulators
+
+  @classmethod
+  def from_segmentations(cls, segmentations, ks):
+    """
+    Given coders' segmentations (represented as segment masses), return
+    the accumulator of their windows of each size in `ks`. The window
+    labels for every size are taken from one array of cumulative
+    boundary counts.
+    """
+    index_lists, m = masses_to_indexes(segmentations)
+    boundaries = boundary_matrix(index_lists, m)
+    cumulative = cumulative_boundaries(boundaries)
+    return cls(ks, [ 
+        WindowAccumulator.from_boundaries(boundaries, k, cumulative) 
+        for k in ks ])
+
+  def merge(self, other):
+    "Return the accumulator of this sequence followed by `other`."
+    assert self.ks == other.ks
+    return SweepAccumulator(self.ks, [ 
+        a.merge(b) for a,b in zip(self.accumulators, other.accumulators) ])
+
+def sweep_coefficients(f, sweep):
+  """
+  Given a function `f` calculating a coefficient from a
+  `WindowAccumulator`, return its value for each window size of a
+  `SweepAccumulator`.
+  """
+  return [ f(accumulator) for accumulator in sweep.accumulators ]
+
+def document_sweep(f, ks, segmentations):
+  """
+  Calculate `sweep_coefficients` for a document's windows of each size
+  in `ks`, and return them along with its `SweepAccumulator`.
+  """
+  sweep = SweepAccumulator.from_segmentations(segmentations, ks)
+  return sweep_coefficients(f, sweep), sweep